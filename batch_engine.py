@@ -0,0 +1,251 @@
+# This program plays many battles at once with NumPy arrays.
+# It follows the same rules as Battle() in battle_simulator.py, every game is a row and all games take their turns in lockstep.
+
+import random
+
+import numpy as np
+
+import battle_simulator
+from battle_simulator import ENERGY_TYPES
+
+# Codes used in BatchOutcome.reason.
+REASON_DRAW = 0
+REASON_KNOCKOUT = 1
+REASON_POINTS = 2
+REASON_NAMES = ("draw", "knockout", "points")
+
+# Games still going after this many turns are counted as draws, Battle() has no such limit but games this long don't happen in practice.
+MAX_TURNS = 500
+
+# The card data Battle() reads from the catalog, as arrays indexed by catalog index.
+class BatchTables:
+    def __init__(self, catalog):
+        move_count = max(len(moves) for moves in catalog.moves) or 1
+        cards = len(catalog.ids)
+        
+        self.is_basic = np.array(catalog.is_basic, dtype = bool)
+        self.is_ex = np.array(catalog.is_ex, dtype = bool)
+        self.hp = np.array(catalog.hp, dtype = np.int32)
+        self.type_code = np.array(catalog.type_code, dtype = np.int32)
+        self.weakness_code = np.array(catalog.weakness_code, dtype = np.int32)
+        self.evolves_from = np.array(catalog.evolves_from_index, dtype = np.int32)
+        
+        # Moves padded to the same count, a padding move does no damage so it is never used.
+        self.move_damage = np.zeros((cards, move_count), dtype = np.int32)
+        self.move_cost = np.zeros((cards, move_count, len(ENERGY_TYPES)), dtype = np.int32)
+        self.move_normal = np.zeros((cards, move_count), dtype = np.int32)
+        for (card, moves) in enumerate(catalog.moves):
+            for (m, (damage, cost)) in enumerate(moves):
+                self.move_damage[card, m] = damage
+                self.move_cost[card, m] = cost[:-1]
+                self.move_normal[card, m] = cost[-1]
+        self.move_typed_total = self.move_cost.sum(axis = -1)
+
+# The tables for the current catalog, rebuilt if the catalog is swapped.
+_tables = None
+
+def GetTables():
+    global _tables
+    catalog = battle_simulator.GetCatalog()
+    if _tables is None or _tables[0] is not catalog:
+        _tables = (catalog, BatchTables(catalog))
+    
+    return _tables[1]
+
+# The results of a batch of games, one entry per game.
+class BatchOutcome:
+    def __init__(self, winner, turns, points, reason):
+        self.winner = winner # 1 if player1 won, 2 if player2 won, 0 for a draw
+        self.turns = turns
+        self.points = points # (games, 2) points of player1 and player2
+        self.reason = reason # REASON_DRAW, REASON_KNOCKOUT or REASON_POINTS
+    
+    def __len__(self):
+        return len(self.winner)
+    
+    # The percentage of games player1 won, like DeckEvaluation().
+    def WinRate(self):
+        return float((self.winner == 1).mean() * 100) if len(self) else 0.0
+    
+    # The winners as the strings BattleOutcome uses.
+    def Winners(self):
+        return [("player1", "player2")[w - 1] if w else None for w in self.winner.tolist()]
+
+# Turns one deck, or one deck per game, into a (games, deck size) array of catalog indices.
+def StackDecks(decks, games):
+    catalog = battle_simulator.GetCatalog()
+    if decks and not isinstance(decks[0], (list, tuple, np.ndarray)):
+        return np.tile(np.array(catalog.Indices(decks), dtype = np.int32), (games, 1))
+    
+    return np.array([catalog.Indices(deck) for deck in decks], dtype = np.int32)
+
+# Turns one energy zone, or one per game, into a (games, 3) array of ENERGY_TYPES indices and the length of each zone.
+def StackZones(zones, games):
+    def Indices(zone):
+        return [energy_type if isinstance(energy_type, int) else battle_simulator.ENERGY_INDEX[energy_type] for energy_type in zone]
+    
+    if zones and not isinstance(zones[0], (list, tuple, np.ndarray)):
+        zones = [zones] * games
+    padded = np.zeros((games, 3), dtype = np.int32)
+    lengths = np.zeros(games, dtype = np.int32)
+    for (g, zone) in enumerate(zones):
+        zone = Indices(zone)
+        padded[g, :len(zone)] = zone
+        lengths[g] = len(zone)
+    
+    return padded, lengths
+
+# Shuffles every deck and redoes the shuffle of any game whose first 5 cards have no basic Pokemon, like StartDeckDraw().
+def ShuffleWithMulligan(decks, is_basic, rng):
+    decks = decks.copy()
+    redo = np.arange(len(decks))
+    while len(redo):
+        order = np.argsort(rng.random((len(redo), decks.shape[1])), axis = 1)
+        decks[redo] = np.take_along_axis(decks[redo], order, axis = 1)
+        redo = redo[~is_basic[decks[redo, :5]].any(axis = 1)]
+    
+    return decks
+
+# Plays games between player1's decks and player2's decks, both given as one deck for every game or a list with a deck per game.
+# Energy zones are given the same way. Returns a BatchOutcome.
+def BatchBattle(decks1, zones1, decks2, zones2, games = None, seed = None):
+    if games is None:
+        games = len(decks1) if decks1 and isinstance(decks1[0], (list, tuple, np.ndarray)) else 1
+    tables = GetTables()
+    rng = np.random.default_rng(seed)
+    
+    # Every array has a row per game and a column per player (0 is player1, 1 is player2).
+    deck = np.stack([StackDecks(decks1, games), StackDecks(decks2, games)], axis = 1)
+    zone_1, zone_length_1 = StackZones(zones1, games)
+    zone_2, zone_length_2 = StackZones(zones2, games)
+    zone = np.stack([zone_1, zone_2], axis = 1)
+    zone_length = np.stack([zone_length_1, zone_length_2], axis = 1)
+    deck_size = deck.shape[2]
+    rows = np.arange(games)
+    
+    # Starting hands, the hand is the cards drawn so far that haven't been played, kept in the order they were drawn.
+    for side in (0, 1):
+        deck[:, side] = ShuffleWithMulligan(deck[:, side], tables.is_basic, rng)
+    in_hand = np.zeros(deck.shape, dtype = bool)
+    in_hand[:, :, :5] = True
+    cursor = np.full((games, 2), 5, dtype = np.int32)
+    
+    # Who goes first.
+    start = rng.integers(0, 2, size = games)
+    
+    # The first basic Pokemon in each hand goes into the active spot.
+    active = np.zeros((games, 2), dtype = np.int32)
+    for side in (0, 1):
+        position = np.argmax(in_hand[:, side] & tables.is_basic[deck[:, side]], axis = 1)
+        active[:, side] = deck[rows, side, position]
+        in_hand[rows, side, position] = False
+    hp = tables.hp[active]
+    energy = np.zeros((games, 2, len(ENERGY_TYPES)), dtype = np.int32)
+    points = np.zeros((games, 2), dtype = np.int32)
+    
+    done = np.zeros(games, dtype = bool)
+    winner = np.zeros(games, dtype = np.int8)
+    turns = np.zeros(games, dtype = np.int32)
+    reason = np.zeros(games, dtype = np.int8)
+    
+    turn = 1
+    while not done.all():
+        g = np.flatnonzero(~done)
+        off = (start[g] + turn - 1) % 2
+        dfn = 1 - off
+        
+        # Draws a card if there are any left.
+        drawing = cursor[g, off] < deck_size
+        in_hand[g[drawing], off[drawing], cursor[g[drawing], off[drawing]]] = True
+        cursor[g, off] += drawing
+        
+        # Attaches a random energy from the energy zone, except on the very first turn.
+        if turn != 1:
+            choice = (rng.random(len(g)) * zone_length[g, off]).astype(np.int32)
+            energy[g, off, zone[g, off, choice]] += 1
+        
+        # Evolves while the hand holds an evolution of the active Pokemon, taking the first one in the hand each time.
+        evolving = g
+        evolving_off = off
+        while len(evolving):
+            hand_cards = deck[evolving, evolving_off]
+            match = in_hand[evolving, evolving_off] & (tables.evolves_from[hand_cards] == active[evolving, evolving_off][:, None])
+            found = match.any(axis = 1)
+            evolving, evolving_off, hand_cards, match = evolving[found], evolving_off[found], hand_cards[found], match[found]
+            position = np.argmax(match, axis = 1)
+            new_card = hand_cards[np.arange(len(evolving)), position]
+            in_hand[evolving, evolving_off, position] = False
+            old_card = active[evolving, evolving_off]
+            hp[evolving, evolving_off] += tables.hp[new_card] - tables.hp[old_card]
+            active[evolving, evolving_off] = new_card
+        
+        # Uses the highest damage move that the attached energy can pay for.
+        card = active[g, off]
+        attached = energy[g, off]
+        cost = tables.move_cost[card]
+        typed_paid = (attached[:, None, :] >= cost).all(axis = -1)
+        left_over = attached.sum(axis = -1)[:, None] - tables.move_typed_total[card]
+        damage = tables.move_damage[card]
+        usable = typed_paid & (tables.move_normal[card] <= left_over) & (damage > 0)
+        defending = active[g, dfn]
+        weak = (tables.weakness_code[defending] != -1) & (tables.weakness_code[defending] == tables.type_code[card])
+        best_damage = (usable * damage).max(axis = 1)
+        total_damage = np.where(best_damage > 0, best_damage + 20 * weak, 0)
+        hp[g, dfn] = np.maximum(hp[g, dfn] - total_damage, 0)
+        
+        # Knockouts give a point, or two for an ex.
+        knocked_out = hp[g, dfn] <= 0
+        ko_g, ko_off, ko_dfn = g[knocked_out], off[knocked_out], dfn[knocked_out]
+        points[ko_g, ko_off] += 1 + tables.is_ex[active[ko_g, ko_dfn]]
+        
+        # The defender promotes the first basic Pokemon in their hand, or loses if there isn't one.
+        basics = in_hand[ko_g, ko_dfn] & tables.is_basic[deck[ko_g, ko_dfn]]
+        promoted = basics.any(axis = 1)
+        position = np.argmax(basics, axis = 1)[promoted]
+        p_g, p_dfn = ko_g[promoted], ko_dfn[promoted]
+        active[p_g, p_dfn] = deck[p_g, p_dfn, position]
+        in_hand[p_g, p_dfn, position] = False
+        hp[p_g, p_dfn] = tables.hp[active[p_g, p_dfn]]
+        energy[p_g, p_dfn] = 0
+        
+        lost = ko_g[~promoted]
+        Finish(done, winner, turns, reason, lost, ko_off[~promoted] + 1, turn, REASON_KNOCKOUT)
+        
+        # Games without a knockout this turn check for a draw and then for three points.
+        quiet_g, quiet_off = g[~knocked_out], off[~knocked_out]
+        if turn == 50:
+            Finish(done, winner, turns, reason, quiet_g, 0, turn, REASON_DRAW)
+        else:
+            won = points[quiet_g, quiet_off] >= 3
+            Finish(done, winner, turns, reason, quiet_g[won], quiet_off[won] + 1, turn, REASON_POINTS)
+        
+        if turn >= MAX_TURNS:
+            Finish(done, winner, turns, reason, np.flatnonzero(~done), 0, turn, REASON_DRAW)
+        turn += 1
+    
+    return BatchOutcome(winner, turns, points, reason)
+
+# Marks games as finished.
+def Finish(done, winner, turns, reason, games, game_winner, turn, game_reason):
+    done[games] = True
+    winner[games] = game_winner
+    turns[games] = turn
+    reason[games] = game_reason
+    
+    return
+
+# Returns the win rate of a deck over n games against random decks, or against deck2 when it is given, like DeckEvaluation().
+# The random opponents are built by GenerateRandomDecks() from a generator seeded with the same seed.
+def BatchDeckEvaluation(deck, n = 10, deck2 = None, seed = None):
+    if seed is None:
+        seed = random.getrandbits(64)
+    
+    if deck2 is not None:
+        opponent_decks, opponent_zones = deck2.deck, deck2.energy_zone
+    else:
+        opponents = battle_simulator.GenerateRandomDecks(None, n, random.Random(seed))
+        opponents = opponents if isinstance(opponents, list) else [opponents]
+        opponent_decks = [opponent.deck for opponent in opponents]
+        opponent_zones = [opponent.energy_zone for opponent in opponents]
+    
+    return BatchBattle(deck.deck, deck.energy_zone, opponent_decks, opponent_zones, n, seed).WinRate()
@@ -1,38 +1,370 @@
 # This program simulates battles between different decks.
 # The decks are composed of cards from Pokemon TCG Pocket.
 
-import json
+import argparse
 import collections
+import concurrent.futures
+import contextlib
+import functools
+import gzip
+import hashlib
+import itertools
+import json
+import math
+import os
 import random
+import threading
+import time
+from types import MappingProxyType
 from typing import Optional
 
-card_ids = [] # initialises the empty card id pool
+from deck_analytics import DeckAnalytics
+from matchup_cache import RANDOM_OPPONENT, DeckSignature, MatchupCache
+
+# The card pool json that ships next to this file, used unless another catalog is loaded.
+DEFAULT_CARD_POOL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "card_pool.json")
+
+# The energy types that can be generated in an energy zone, "Normal" costs can be paid with any of them.
+ENERGY_TYPES = ("Grass", "Fire", "Water", "Electric", "Psychic", "Fighting", "Dark", "Metal")
+ENERGY_INDEX = {energy_type: i for (i, energy_type) in enumerate(ENERGY_TYPES)}
+
+# Turns an energy cost like {"Grass": 1, "Normal": 2} into a fixed order vector, with the "Normal" cost at the end.
+def EnergyCostVector(energy_cost):
+    return tuple(energy_cost.get(energy_type, 0) for energy_type in ENERGY_TYPES) + (energy_cost.get("Normal", 0),)
+
+# A compiled index of the card pool, built once so lookups during battles don't rebuild a dictionary every call.
+# Everything in here is derived from the card data and is read-only so it can be shared between every game.
+class CardCatalog:
+    def __init__(self, card_pool):
+        self.cards = tuple(card_pool)
+        self.by_id = MappingProxyType({card["id"]: card for card in card_pool}) # O(1) id -> card lookup
+        
+        # Basic Pokemon are the only cards which can be played into the active spot.
+        self.basic_ids = frozenset(card["id"] for card in card_pool
+                                   if card.get("cardType") == "Pokemon" and card.get("evolutionStage") == 0)
+        self.ex_ids = frozenset(card["id"] for card in card_pool if card["name"].endswith(" ex"))
+        
+        # Evolution lines in both directions.
+        self.evolves_from = MappingProxyType({card["id"]: card["evolvesFrom"] for card in card_pool
+                                              if card.get("cardType") == "Pokemon" and card.get("evolvesFrom")})
+        evolutions = {}
+        for card_id, previous_id in self.evolves_from.items():
+            evolutions.setdefault(previous_id, []).append(card_id)
+        self.evolutions_of = MappingProxyType({card_id: tuple(ids) for (card_id, ids) in evolutions.items()})
+        
+        # Typed energy cost vectors for every move, and the highest damage move of each card.
+        energy_costs = {}
+        best_move = {}
+        for card in card_pool:
+            moves = card.get("moves") or []
+            energy_costs[card["id"]] = tuple(EnergyCostVector(move["energyCost"]) for move in moves)
+            damaging = [move for move in moves if move.get("damage") > 0]
+            best_move[card["id"]] = max(damaging, key = lambda move: move["damage"]) if damaging else None
+        self.energy_costs = MappingProxyType(energy_costs)
+        self.best_move = MappingProxyType(best_move)
+        
+        # Cards are identified by their position in the pool during battles, these tuples are indexed by it.
+        self.ids = tuple(card["id"] for card in card_pool)
+        self.index = MappingProxyType({card_id: i for (i, card_id) in enumerate(self.ids)})
+        card_types = list(ENERGY_TYPES)
+        card_types += sorted({card["type"] for card in card_pool if card.get("type") and card["type"] not in card_types})
+        type_index = {card_type: i for (i, card_type) in enumerate(card_types)}
+        self.hp = tuple(card.get("hp", 0) for card in card_pool)
+        self.type_code = tuple(type_index.get(card.get("type"), -1) for card in card_pool)
+        self.weakness_code = tuple(type_index.get((card.get("weakness") or {}).get("type"), -1) for card in card_pool)
+        self.is_basic = tuple(card_id in self.basic_ids for card_id in self.ids)
+        self.is_ex = tuple(card_id in self.ex_ids for card_id in self.ids)
+        self.evolves_from_index = tuple(self.index.get(self.evolves_from.get(card_id), -1) for card_id in self.ids)
+        self.moves = tuple(tuple((move["damage"], cost) for (move, cost) in zip(card.get("moves") or [], energy_costs[card["id"]]))
+                           for card in card_pool) # (damage, energy cost vector) for each move
+        self.move_types = tuple(frozenset(i for (damage, cost) in moves for i in range(len(ENERGY_TYPES)) if cost[i])
+                                for moves in self.moves) # the energy types a card's moves need
+        self.has_damaging_move = tuple(any(damage > 0 for (damage, cost) in moves) for moves in self.moves)
+        self.all_indices = tuple(range(len(self.ids)))
+        
+        # Attached energy is summarised as a number for looking up which move can be used: each type's count is capped at
+        # the largest total cost of any move (counts above it can pay for the same moves) and used as a digit.
+        self.energy_cap = max([sum(cost) for moves in self.moves for (damage, cost) in moves] + [1])
+        self.energy_place = tuple((self.energy_cap + 1) ** i for i in range(len(ENERGY_TYPES)))
+        # For each card, energy code -> damage of the best move that energy can pay for (0 if none), filled in as codes are seen.
+        self.move_tables = tuple({} for card in self.ids)
+        
+        # Exact draw and energy chances of decks, worked out the first time a deck is asked about.
+        self.analytics = DeckAnalytics(self.by_id, self.basic_ids)
+    
+    def __len__(self):
+        return len(self.cards)
+    
+    def __contains__(self, card_id):
+        return card_id in self.by_id
+    
+    # Converts a list of card ids (or indices) into a new list of catalog indices.
+    def Indices(self, cards):
+        index = self.index
+        return [card if isinstance(card, int) else index[card] for card in cards]
+    
+    # The energy code of a list of attached energy counts, as kept up to date by Pokemon.AttachEnergy().
+    def EnergyCode(self, attached):
+        cap = self.energy_cap
+        return sum(min(amount, cap) * place for (amount, place) in zip(attached, self.energy_place))
+    
+    # The damage of the highest damage move the card can pay for with this energy (0 if none), looked up in the card's
+    # move table and worked out with CanPayCost() the first time that energy code is seen.
+    def BestUsableDamage(self, card, code, attached):
+        table = self.move_tables[card]
+        damage = table.get(code)
+        if damage is None:
+            damage = max([move_damage for (move_damage, cost) in self.moves[card] if move_damage > 0 and CanPayCost(attached, cost)] + [0])
+            table[code] = damage
+        
+        return damage
+    
+    # The catalog indices of the cards in a card pool list (all of them for the catalog's own cards).
+    def PoolIndices(self, card_pool):
+        if card_pool is None or card_pool is self.cards:
+            return self.all_indices
+        return tuple(self.index[card["id"]] for card in card_pool)
+    
+    # Converts a list of catalog indices back into card ids.
+    def Ids(self, cards):
+        ids = self.ids
+        return [ids[card] for card in cards]
+    
+    # Whether a deck (catalog indices) with an energy zone (ENERGY_TYPES indices) can never attack, see DeckAnalytics.Hopeless().
+    def Hopeless(self, deck, energy_zone):
+        return self.analytics.Hopeless(self.Ids(deck), [ENERGY_TYPES[energy_type] for energy_type in energy_zone])
+
+# This imports the data from a card pool json into a CardCatalog.
+def LoadCardCatalog(path = DEFAULT_CARD_POOL_PATH):
+    with open(path, "r") as file:
+        return CardCatalog(json.load(file))
+
+# The shared card index used by every game, nothing is loaded until it is first needed.
+catalog = None
+
+# Makes every game use this catalog from now on.
+def SetCatalog(new_catalog):
+    global catalog
+    catalog = new_catalog
+    
+    return
+
+# Returns the shared catalog, loading the default card pool the first time it is needed.
+def GetCatalog():
+    if catalog is None:
+        SetCatalog(LoadCardCatalog())
+    
+    return catalog
+
+# Counts what happens in the simulator (games, turns, draws, validation failures, mutations) instead of printing each event.
+# Counter names are dotted, like "validation.copies" or "mutation.accepted".
+# Counts can be added from several threads, like the pairs of a generation being mutated at the same time.
+class Metrics:
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+    
+    def Count(self, name, amount = 1):
+        with self.lock:
+            self.counts[name] += amount
+        
+        return
+    
+    # Adds counts collected somewhere else, like in a worker process.
+    def Merge(self, counts):
+        with self.lock:
+            self.counts.update(counts)
+        
+        return
+    
+    # The counters grouped by their prefix, plus averages and rates worked out from them.
+    def Summary(self):
+        summary = {}
+        for (name, value) in sorted(self.counts.items()):
+            group, _, key = name.rpartition(".")
+            summary.setdefault(group or "total", {})[key] = value
+        
+        counts = self.counts
+        if counts["games"]:
+            summary["rates"] = {
+                "turns_per_game": counts["turns"] / counts["games"],
+                "draw_rate": counts["result.draw"] / counts["games"]
+                }
+        if counts["mutation.attempts"]:
+            summary.setdefault("rates", {})["mutation_acceptance"] = counts["mutation.accepted"] / counts["mutation.attempts"]
+        
+        return summary
+    
+    # A printable version of Summary().
+    def Report(self):
+        lines = []
+        for (group, values) in self.Summary().items():
+            lines.append(group + ": " + ", ".join("{} {}".format(key, round(value, 3)) for (key, value) in values.items()))
+        
+        return "\n".join(lines)
+
+# The active Metrics, while this is None nothing is counted and the simulator only pays for an "is not None" check.
+metrics = None
+
+# Starts counting into the given Metrics (or a new one), which is returned.
+def EnableMetrics(collector = None):
+    global metrics
+    metrics = collector if collector is not None else Metrics()
+    
+    return metrics
+
+# Stops counting.
+def DisableMetrics():
+    global metrics
+    metrics = None
+    
+    return
+
+# Times the phases of every turn in Battle() (drawing, energy, evolution, moves, knockouts, promotion, end of turn checks
+# and recording) and keeps a histogram of each, so where the time goes can be compared across many games and releases.
+# Durations are in nanoseconds and histogram bucket b holds the durations from 2^(b - 1) up to 2^b.
+class PhaseTimer:
+    def __init__(self):
+        self.phases = {} # phase -> [count, total, collections.Counter of bucket -> count]
+        self.lock = threading.Lock() # for Merge(), which can be called from several threads
+    
+    def Add(self, phase, nanoseconds):
+        entry = self.phases.get(phase)
+        if entry is None:
+            entry = self.phases[phase] = [0, 0, collections.Counter()]
+        entry[0] += 1
+        entry[1] += nanoseconds
+        entry[2][nanoseconds.bit_length()] += 1
+        
+        return
+    
+    # Adds the time since the previous lap to a phase and returns the time of this lap.
+    def Lap(self, phase, since):
+        now = time.perf_counter_ns()
+        self.Add(phase, now - since)
+        
+        return now
+    
+    # The timings in a form that can be sent between processes and passed to Merge().
+    def State(self):
+        return {phase: (count, total, dict(buckets)) for (phase, (count, total, buckets)) in self.phases.items()}
+    
+    # Adds timings collected somewhere else, like in a worker process.
+    def Merge(self, state):
+        with self.lock:
+            for (phase, (count, total, buckets)) in state.items():
+                entry = self.phases.get(phase)
+                if entry is None:
+                    entry = self.phases[phase] = [0, 0, collections.Counter()]
+                entry[0] += count
+                entry[1] += total
+                entry[2].update(buckets)
+        
+        return
+    
+    # The upper bound of the bucket the given fraction of a phase's durations fall under, in nanoseconds.
+    def Percentile(self, phase, fraction):
+        count, total, buckets = self.phases[phase]
+        seen = 0
+        for bucket in sorted(buckets):
+            seen += buckets[bucket]
+            if seen >= fraction * count:
+                return pow(2, bucket)
+        
+        return 0
+    
+    # Count, total and mean of each phase with rough percentiles from the histogram and its share of all the time timed.
+    def Summary(self):
+        everything = sum(total for (count, total, buckets) in self.phases.values()) or 1
+        summary = {}
+        for (phase, (count, total, buckets)) in sorted(self.phases.items(), key = lambda item: -item[1][1]):
+            summary[phase] = {
+                "count": count,
+                "total_ms": total / 1e6,
+                "mean_us": total / count / 1e3,
+                "p50_us": self.Percentile(phase, 0.5) / 1e3,
+                "p99_us": self.Percentile(phase, 0.99) / 1e3,
+                "share": total / everything,
+                "histogram": {pow(2, bucket): amount for (bucket, amount) in sorted(buckets.items())}
+                }
+        
+        return summary
+    
+    # A printable version of Summary().
+    def Report(self):
+        lines = []
+        for (phase, values) in self.Summary().items():
+            lines.append("{:<10} {:>9} times {:10.2f}ms {:8.2f}us mean {:8.2f}us p50 {:8.2f}us p99 {:6.1%}".format(
+                phase, values["count"], values["total_ms"], values["mean_us"], values["p50_us"], values["p99_us"], values["share"]))
+        
+        return "\n".join(lines)
+
+# The active PhaseTimer, like metrics nothing is timed while this is None.
+phase_timer = None
 
-# This imports the data from the card pool json.
-with open("card_pool.json", "r") as file:
-    cardPool = json.load(file)
+# Starts timing turn phases into the given PhaseTimer (or a new one), which is returned.
+def EnablePhaseTiming(timer = None):
+    global phase_timer
+    phase_timer = timer if timer is not None else PhaseTimer()
+    
+    return phase_timer
 
-# Extracts all IDs from the cardPool to be able to identify each Pokemon.
-card_ids = [card["id"] for card in cardPool]
+# Stops timing turn phases.
+def DisablePhaseTiming():
+    global phase_timer
+    phase_timer = None
+    
+    return
 
 # Creates a class for each Pokemon card.
+# The card itself is stored as its index in the catalog, everything fixed about the card is read from there.
 class Pokemon:
-    def __init__(self, card_data):
-        self.id = card_data["id"]
-        self.name = card_data["name"]
-        if (card_data["cardType"] == "Pokemon") or (card_data.get("trainerType") == "playableItem"):
-            self.max_hp = card_data["hp"]
-            self.current_hp = card_data["hp"] # the current hp of the Pokemon (which is initialised as its maximum)
-            self.type = card_data["type"]
-            self.evolution_stage = card_data["evolutionStage"]
-            self.ability = card_data["ability"] # special abilities
-            self.moves = card_data["moves"]
-            self.weakness = card_data["weakness"]
-            self.retreat = card_data["retreat"]
-            self.attached_energy = {} # initialises an empty energy field so it can be added to later
-            self.status_condition = {} # for status conditions (like poison, sleep, etc.)
-        elif card_data["trainerType"] == "Supporter":
-            self.ability = card_data["ability"] # the card's effect
+    __slots__ = ("card", "current_hp", "attached_energy", "energy_code", "status_condition")
+    
+    def __init__(self, card):
+        if not isinstance(card, int):
+            card = catalog.index[card["id"] if isinstance(card, dict) else card]
+        self.card = card
+        self.current_hp = catalog.hp[card] # the current hp of the Pokemon (which is initialised as its maximum)
+        self.attached_energy = [0] * len(ENERGY_TYPES) # the amount of each energy type attached, in ENERGY_TYPES order
+        self.energy_code = 0 # catalog.EnergyCode() of the attached energy
+        self.status_condition = None # for status conditions (like poison, sleep, etc.), only created when needed
+    
+    @property
+    def id(self):
+        return catalog.ids[self.card]
+    
+    @property
+    def name(self):
+        return catalog.cards[self.card]["name"]
+    
+    @property
+    def max_hp(self):
+        return catalog.hp[self.card]
+    
+    @property
+    def type(self):
+        return catalog.cards[self.card].get("type")
+    
+    @property
+    def evolution_stage(self):
+        return catalog.cards[self.card].get("evolutionStage")
+    
+    @property
+    def ability(self):
+        return catalog.cards[self.card].get("ability") # special abilities
+    
+    @property
+    def moves(self):
+        return catalog.cards[self.card].get("moves") or []
+    
+    @property
+    def weakness(self):
+        return catalog.cards[self.card].get("weakness")
+    
+    @property
+    def retreat(self):
+        return catalog.cards[self.card].get("retreat")
     
     # Dictionary that can be put into json files.
     def to_dict(self):
@@ -47,13 +379,14 @@ class Pokemon:
             "moves": self.moves,
             "weakness": self.weakness,
             "retreat": self.retreat,
-            "attached_energy": self.attached_energy,
-            "status_condition": self.status_condition
+            "attached_energy": {ENERGY_TYPES[i]: amount for (i, amount) in enumerate(self.attached_energy) if amount},
+            "status_condition": dict(self.status_condition or {})
             }
     
     # A function for whenever a Pokemon takes damage.
     def PokemonDamage(offender, defender, damage):
-        if defender.weakness and offender.type == defender.weakness["type"]:
+        weakness = catalog.weakness_code[defender.card]
+        if weakness != -1 and weakness == catalog.type_code[offender.card]:
             defender.current_hp -= damage + 20
         else:
             defender.current_hp -= damage
@@ -63,32 +396,43 @@ class Pokemon:
         
         return
     
+    # Evolves the Pokemon into another card, keeping its damage, energy and status conditions.
+    def Evolve(self, card):
+        reduced_hp = catalog.hp[self.card] - self.current_hp
+        self.card = card
+        self.current_hp = catalog.hp[card] - reduced_hp
+        
+        return
+    
     # A function for adding energy to a Pokemon.
     def AttachEnergy(self, energy_type, amount):
-        if energy_type in self.attached_energy:
-            self.attached_energy[energy_type] += amount
-        else:
-            self.attached_energy[energy_type] = amount
+        if not isinstance(energy_type, int):
+            energy_type = ENERGY_INDEX[energy_type]
+        attached = self.attached_energy[energy_type]
+        self.attached_energy[energy_type] = attached + amount
+        if attached < catalog.energy_cap:
+            self.energy_code += (min(attached + amount, catalog.energy_cap) - attached) * catalog.energy_place[energy_type]
         
         return
     
     # A function for removing energy from a Pokemon.
     def RemoveEnergy(self, amount, energy_type: Optional[str] = None):
         if energy_type == None:
-            self.attached_energy[list(self.attached_energy)[0]] -= amount
-            
-            if self.attached_energy[list(self.attached_energy)[0]] < 0:
-                self.attached_energy[list(self.attached_energy)[0]] = 0
-            
-            if self.attached_energy[list(self.attached_energy)[0]] == 0:
-                self.attached_energy.pop(list(self.attached_energy)[0])
-            
-            return
-        else:
-            self.attached_energy[energy_type] -= amount
+            # Removes from the first energy type that is attached.
+            for i, attached in enumerate(self.attached_energy):
+                if attached:
+                    energy_type = i
+                    break
+            else:
+                return
+        elif not isinstance(energy_type, int):
+            energy_type = ENERGY_INDEX[energy_type]
+        
+        self.attached_energy[energy_type] -= amount
         
-        if self.attached_energy[energy_type] <= 0:
-            self.attached_energy.pop(energy_type)
+        if self.attached_energy[energy_type] < 0:
+            self.attached_energy[energy_type] = 0
+        self.energy_code = catalog.EnergyCode(self.attached_energy)
         
         return
     
@@ -103,6 +447,8 @@ class Pokemon:
     
     # A function for a status update.
     def AddStatus(self, status):
+        if self.status_condition is None:
+            self.status_condition = {}
         self.status_condition[status] = 1
         
         return
@@ -114,111 +460,167 @@ class Pokemon:
         return
 
 # Creates a Player class.
+# The deck, hand and discard pile hold catalog indices, and the energy zone holds ENERGY_TYPES indices.
 class Player:
-    def __init__(self, deck, energy_zone):
-        self.deck = deck[:] # makes a copy of the deck
+    __slots__ = ("deck", "deck_cursor", "hand", "discard_pile", "energy_zone", "active_pokemon", "bench_pokemon",
+                 "startplayer", "energy_generated", "points", "rng")
+    
+    # rng is where this player's shuffles and energy generation come from, the random module unless a game is seeded.
+    def __init__(self, deck, energy_zone, rng = random):
+        self.deck = GetCatalog().Indices(deck) # makes a copy of the deck (every game starts with players, so this loads the catalog)
+        self.deck_cursor = 0 # cards before the cursor have been drawn, the deck itself is never shortened
         self.hand = [] # initialises an empty hand
         self.discard_pile = [] # initialises an empty discard pile
-        self.energy_zone = energy_zone[:] # transfers the energies
+        self.energy_zone = [energy_type if isinstance(energy_type, int) else ENERGY_INDEX[energy_type]
+                            for energy_type in energy_zone] # transfers the energies
         self.active_pokemon = None
         self.bench_pokemon = []
         self.startplayer = False
         self.energy_generated = None
         self.points = 0
+        self.rng = rng
+    
+    # The card ids of the deck, as used in the card pool json.
+    @property
+    def deck_ids(self):
+        return catalog.Ids(self.deck)
+    
+    # The energy type names of the energy zone.
+    @property
+    def energy_names(self):
+        return [ENERGY_TYPES[energy_type] for energy_type in self.energy_zone]
+    
+    # The same for any order of the same cards and energies, used to look decks up in a MatchupCache.
+    @property
+    def signature(self):
+        return DeckSignature(catalog.Ids(self.deck), self.energy_names)
     
     # Dictionary that can be put into json files.
     def to_dict(self):
         return {
-            "deck": self.deck,
-            "hand": self.hand,
-            "discard_pile": self.discard_pile,
-            "energy_zone": self.energy_zone,
+            "deck": catalog.Ids(self.deck[self.deck_cursor:]),
+            "hand": catalog.Ids(self.hand),
+            "discard_pile": catalog.Ids(self.discard_pile),
+            "energy_zone": self.energy_names,
             "active_pokemon": self.active_pokemon.to_dict() if self.active_pokemon else None,
             "bench_pokemon": [poke.to_dict() for poke in self.bench_pokemon],
             "startplayer": self.startplayer,
-            "energy_generated": self.energy_generated,
+            "energy_generated": ENERGY_TYPES[self.energy_generated] if self.energy_generated is not None else None,
             "points": self.points
             }
     
     # Shuffles the deck into a randomised order.
     def DeckShuffle(self):
-        return random.shuffle(self.deck)
-
-    # Removes the top card from the deck and adds it to the designated array (hand or discards).
+        return self.rng.shuffle(self.deck)
+    
+    # Takes the top card from the deck and adds it to the hand, by moving the cursor along the shuffled deck.
     def DeckDraw(self, n):
-        for i in range(n): # removes the n amount of cards from the deck
-            if not self.deck:
+        for i in range(n): # draws the n amount of cards from the deck
+            if self.deck_cursor >= len(self.deck):
                 return
             else:
-                self.hand.append(self.deck.pop(0))
+                self.hand.append(self.deck[self.deck_cursor])
+                self.deck_cursor += 1
         return
-
+    
     # Draws the starting hand for each player.
+    # Instead of reshuffling until the first 5 cards hold a basic Pokemon, the number of basics in the hand is drawn from the
+    # distribution of the reshuffle loop (a hypergeometric that has at least one basic) and the hand is built from that,
+    # which gives every deck order with a basic in the first 5 cards the same chance, just like the loop did.
+    # Raises ValueError for a deck that breaks the deck rules, as it could never put a basic Pokemon in the active spot.
     def StartDeckDraw(self):
         if not Player.DeckValidation(self): # checks if the deck is valid
-            return
+            raise ValueError(InvalidDeckMessage(self))
         
-        basicInHand = False # currently no basic Pokemon in the player's hand
+        is_basic = catalog.is_basic
+        basics = [card for card in self.deck if is_basic[card]]
+        others = [card for card in self.deck if not is_basic[card]]
+        self.rng.shuffle(basics)
+        self.rng.shuffle(others)
         
-        # While there is not a basic Pokemon in the hand this loop shall continue indefinitely.
-        while not basicInHand:
-            self.deck.extend(self.hand) # puts the cards from the hand back into the deck
-            self.hand.clear() # removes the cards from the hand
-            
-            Player.DeckShuffle(self) # shuffles the deck
-            Player.DeckDraw(self, 5) # draws 5 cards (the starting amount) from the deck
-            
-            # Checks for the basic Pokemon.
-            hand_lookup = {card["id"]: card for card in cardPool} # creates a dictionary of the hand cards
-            for card_id in self.hand:
-                if(hand_lookup[card_id].get("evolutionStage") == 0): # checks if the hand contains a basic Pokemon
-                    basicInHand = True # in order to stop the while loop
-                    break
+        weights = OpeningHandWeights(len(self.deck), len(basics))
+        basic_count = self.rng.choices(range(len(weights)), weights)[0]
+        
+        # The hand and the rest of the deck, each in a random order.
+        hand = basics[:basic_count] + others[:5 - basic_count]
+        rest = basics[basic_count:] + others[5 - basic_count:]
+        self.rng.shuffle(hand)
+        self.rng.shuffle(rest)
+        
+        self.deck[:] = hand + rest
+        self.deck_cursor = 0
+        self.hand.clear()
+        Player.DeckDraw(self, 5) # draws 5 cards (the starting amount) from the deck
         
         return
     
     # Defines the deck rules and checks them against proposed deck.
     def DeckValidation(self):
-        deck_ids = self.deck
+        deck = self.deck
         
         # Rule 1: Decks cannot be more than 20 cards.
-        if(len(deck_ids) != 20): # checks whether the deck is the appropiate length
-            print("F@20") # failure at deck size 20
+        if(len(deck) != 20): # checks whether the deck is the appropiate length
+            if metrics is not None:
+                metrics.Count("validation.size") # failure at deck size 20
             return False
         
-        deck_freq = collections.Counter(deck_ids) # creates a frequency array of the deck_ids
+        deck_freq = collections.Counter(deck) # creates a frequency array of the deck
         
         # Rule 2: No more than 2 cards of each id.
         for (key, value) in deck_freq.items():
             if(value > 2): # checks if the frequency is more than 2
-                print(key, value)
-                print("F@<2") # failure at frequency of each being less than 2
+                if metrics is not None:
+                    metrics.Count("validation.copies") # failure at frequency of each being less than 2
                 return False
         
         # Rule 3: Deck must contain at least 1 basic Pokemon.
-        deck_lookup = {card["id"]: card for card in cardPool} # creates a dictionary of the deck cards
-        for card_id in deck_ids:
-            if(deck_lookup[card_id].get("cardType") == "Pokemon") and (deck_lookup[card_id].get("evolutionStage") == 0): # is this card a basic pokemon
+        is_basic = catalog.is_basic
+        for card in deck:
+            if is_basic[card]: # is this card a basic pokemon
                 break
         else:
-            print("F@B") # failure at containing a basic Pokemon
+            if metrics is not None:
+                metrics.Count("validation.basic") # failure at containing a basic Pokemon
             return False
         
         # Rule 4: Must contain at least one energy, but no more than 3.
         if(not 0 < len(self.energy_zone) < 4):
-            print("F@E") # failure at containing the appropiate amount of energies
+            if metrics is not None:
+                metrics.Count("validation.energy") # failure at containing the appropiate amount of energies
             return False
         
+        if metrics is not None:
+            metrics.Count("validation.passed")
+        
         return True # this deck is valid
 
+# The error message for a deck that breaks the deck rules.
+def InvalidDeckMessage(player):
+    return ("Invalid deck {} with energy zone {}: decks need 20 cards, no more than 2 of each id, a basic Pokemon "
+            "and 1 to 3 energy types".format(catalog.Ids(player.deck), player.energy_names))
+
+# Raises ValueError if a Player's deck breaks the deck rules.
+def ValidateDeck(player):
+    if not player.DeckValidation():
+        raise ValueError(InvalidDeckMessage(player))
+    
+    return player
+
+# How likely an opening hand of 5 is to hold each number of basic Pokemon (the index), given that it holds at least one.
+@functools.lru_cache(maxsize = None)
+def OpeningHandWeights(deck_size, basic_count):
+    hand_size = min(5, deck_size)
+    return tuple(math.comb(basic_count, k) * math.comb(deck_size - basic_count, hand_size - k) if k > 0 else 0
+                 for k in range(min(hand_size, basic_count) + 1))
+
 # Creates the game setting and starting positions of each side.
-def GameBegin(player1, player2):
+def GameBegin(player1, player2, rng = random):
     # Determines starting hands.
     Player.StartDeckDraw(player1)
     Player.StartDeckDraw(player2)
     
     # Determines who goes first.
-    coin = random.randint(0, 1)
+    coin = rng.randint(0, 1)
     if coin == 1:
         player1.startplayer = True
     elif coin == 0:
@@ -228,45 +630,43 @@ def GameBegin(player1, player2):
 
 # Creates a function to be run at the beginning for each player to play the first active Pokemon.
 def PokemonActive(player, pokemon):
-    deck_lookup = {card["id"]: card for card in cardPool}
-    if(deck_lookup[pokemon].get("cardType") == "Pokemon") and (deck_lookup[pokemon].get("evolutionStage") == 0):
+    if catalog.is_basic[pokemon]:
         player.hand.remove(pokemon)
-        player.active_pokemon = Pokemon(deck_lookup.get(pokemon))
-    else:
-        print("F@AB")
+        player.active_pokemon = Pokemon(pokemon)
+    elif metrics is not None:
+        metrics.Count("errors.active_not_basic")
     
     return
 
 # Generates a randomised energy from the energies present in the energy zone.
 def EnergyZoneGeneration(player):
-    player.energy_generated = random.choice(player.energy_zone)
+    player.energy_generated = player.rng.choice(player.energy_zone)
     
     return
 
 # Checks if the Pokemon in question can use a certain move and has the prerequist energies attached.
 def CanUseMove(pokemon, move):
-    required = move["energyCost"]
-    attached = pokemon.attached_energy.copy()
+    return CanPayCost(pokemon.attached_energy, EnergyCostVector(move["energyCost"]))
+
+# Checks attached energy counts against an energy cost vector from EnergyCostVector().
+def CanPayCost(attached, cost):
+    total_left = 0
     
     # Checks if the required amount for each energy is present.
-    for energy_type, cost in required.items():
-        if energy_type != "Normal":
-            if attached.get(energy_type, 0) < cost:
-                return False
-            attached[energy_type] -= cost
-    
-    normal_energy_cost = required.get("Normal", 0)
-    total_left = sum(attached.values())
+    for i in range(len(attached)):
+        if attached[i] < cost[i]:
+            return False
+        total_left += attached[i] - cost[i]
     
     # As normal energy is not an actual energy it checks it's cost against all remaining energies.
-    if normal_energy_cost > total_left:
+    if cost[-1] > total_left:
         return False
     
     return True
 
 # Creates a log of the current game state for neural network training at a later date.
 # Currently logs are not recorded as it would be counter-productive this early on, however the ability to do so is here.
-# This function currently is used to detect which player won the match.
+# It is only called when Battle() is given a BattleLogger at the LOG_FULL level.
 def RecordCurrentGameState(player1, player2, turn, result, winner = None):
     if player1.startplayer == False:
         p = player1
@@ -283,146 +683,742 @@ def RecordCurrentGameState(player1, player2, turn, result, winner = None):
     
     return state
 
+# How much a BattleLogger records, each level also records everything the levels below it do.
+LOG_NONE = 0 # nothing is recorded
+LOG_OUTCOME = 1 # only the outcome of the game
+LOG_SUMMARY = 2 # a small summary of every turn
+LOG_FULL = 3 # a full RecordCurrentGameState() snapshot of every turn
+
+# The result of a single battle, this is all that is built unless a logger is given to Battle().
+class BattleOutcome:
+    __slots__ = ("winner", "turns", "points", "reason")
+    
+    def __init__(self, winner, turns, points, reason):
+        self.winner = winner # "player1", "player2" or None for a draw
+        self.turns = turns
+        self.points = points # (player1 points, player2 points)
+        self.reason = reason # "knockout", "points", "draw" or "no active"
+    
+    # Dictionary that can be put into json files.
+    def to_dict(self):
+        return {
+            "winner": self.winner,
+            "turns": self.turns,
+            "points": list(self.points),
+            "reason": self.reason
+            }
+
+# Collects the records of a battle when passed to Battle(), only building the records its level asks for.
+# Subclasses can override Record() and EndGame() to send the records elsewhere.
+class BattleLogger:
+    def __init__(self, level = LOG_FULL):
+        self.level = level
+        self.entries = []
+        self.players = None
+    
+    # Called once the players are set up, before the first turn.
+    def BeginGame(self, player1, player2):
+        self.players = (player1, player2)
+        
+        return
+    
+    # Called at the end of every turn with the result of that turn.
+    def Record(self, offender, defender, turn, result, winner = None):
+        if self.level >= LOG_FULL:
+            self.entries.append(RecordCurrentGameState(offender, defender, turn, result, winner))
+        elif self.level >= LOG_SUMMARY:
+            self.entries.append(self.TurnSummary(offender, turn, result, winner))
+        
+        return
+    
+    # Called once with the BattleOutcome of the game.
+    def EndGame(self, outcome):
+        if self.level == LOG_OUTCOME:
+            self.entries.append(outcome.to_dict())
+        
+        return
+    
+    # A small per-turn record, with the players in the order they were passed to Battle().
+    def TurnSummary(self, offender, turn, result, winner):
+        player1, player2 = self.players
+        active = [player.active_pokemon for player in self.players]
+        
+        return {
+            "turn": turn,
+            "offender": "player1" if offender is player1 else "player2",
+            "active": [pokemon.id if pokemon else None for pokemon in active],
+            "hp": [pokemon.current_hp if pokemon else 0 for pokemon in active],
+            "points": [player1.points, player2.points],
+            "result": result,
+            "winner": winner
+            }
+
+# Fills a deck up to 20 cards so that it is valid straight away, instead of drawing cards and throwing invalid decks away.
+# Cards that already have 2 copies are never drawn, and if there is no basic Pokemon yet the first card added is one.
+# With coherent set, cards whose moves can be paid for by the energy zone are drawn more often and evolved Pokemon
+# bring their earlier stages with them when there is room.
+def FillDeck(kept, energy_zone, candidates, rng = random, coherent = False):
+    is_basic = catalog.is_basic
+    deck = list(kept)
+    copies = collections.Counter(deck)
+    zone = set(energy_zone)
+    candidate_set = set(candidates)
+    
+    # Only cards that can attack are favoured, cards without moves (like trainers) need no energy but do nothing.
+    def Weights(options):
+        if not coherent:
+            return None
+        return [4 if catalog.has_damaging_move[card] and catalog.move_types[card] <= zone else 1 for card in options]
+    
+    # Draws a card that still has a copy left, there is always one as no card can take up more than 2 of the 20 spots.
+    def Draw(options, weights):
+        while True:
+            card = rng.choice(options) if weights is None else rng.choices(options, weights)[0]
+            if copies[card] < 2:
+                return card
+    
+    def Add(card):
+        deck.append(card)
+        copies[card] += 1
+        
+        # Brings in the earlier stage too, if the deck doesn't already have it.
+        previous = catalog.evolves_from_index[card]
+        if coherent and previous != -1 and copies[previous] == 0 and previous in candidate_set and len(deck) < 20:
+            Add(previous)
+        
+        return
+    
+    if not any(is_basic[card] for card in deck):
+        basics = [card for card in candidates if is_basic[card]]
+        Add(Draw(basics, Weights(basics)))
+    
+    weights = Weights(candidates)
+    while len(deck) < 20:
+        Add(Draw(candidates, weights))
+    
+    return deck
+
+# Swaps n random cards of a deck for cards drawn with FillDeck(), so the mutant is valid. The energy zone is kept.
+def MutatedDeck(deck, n, candidates, rng = random, coherent = False):
+    kept = deck.deck[:]
+    for j in range(n):
+        kept.pop(rng.randrange(len(kept)))
+    
+    return Player(FillDeck(kept, deck.energy_zone, candidates, rng, coherent), deck.energy_zone)
+
 # A supporting function for Mutate(), changes the cards randomly to other cards.
-def NumberOfMutatedCards(deck, cardPool, n):
-    for i in range(1000): # high range is only here to prevent infinity looping
-        shadow_deck = Player(deck.deck[:], deck.energy_zone[:])
-        for j in range(n):
-            shadow_deck.deck.pop(random.randrange(len(shadow_deck.deck)))
-        new_deck_ids = [card["id"] for card in random.choices(cardPool, k = n)]
-        shadow_deck.deck.extend(new_deck_ids)
-        
-        if Player.DeckValidation(shadow_deck):
-            winrate = DeckEvaluation(shadow_deck, cardPool, 10, deck)
-            if winrate > 50:
-                return shadow_deck
-            else:
+# The replacement cards are drawn with FillDeck() so every mutant is valid, and each mutant battles the original deck
+# with SequentialEvaluation() until it is clearly better or worse (or max_games have been played).
+# With paired set each mutant is instead compared with the original deck by PairedEvaluation() over up to max_games games,
+# all mutants share the same opponents so the original deck's games are only played once.
+# With prefilter set, mutants that could never attack are thrown away before they play any games.
+# Mutants are made block at a time and evaluated side by side so a pool has all of their games to spread over its workers,
+# the first one of the block that is accepted is returned. block is fixed rather than taken from the pool,
+# so the mutant found is the same for any number of workers.
+def NumberOfMutatedCards(deck, cardPool, n, rng = random, pool = None, coherent = False, max_games = 30, cache = None, paired = False,
+                         prefilter = True, block = 4):
+    catalog = GetCatalog()
+    candidates = catalog.PoolIndices(cardPool)
+    if paired:
+        paired_seed = rng.getrandbits(64)
+        parent_scores = {}
+    
+    attempts = 0
+    while attempts < 1000: # high limit is only here to prevent infinity looping
+        shadow_decks = []
+        seeds = []
+        while len(shadow_decks) < block and attempts < 1000:
+            attempts += 1
+            shadow_deck = MutatedDeck(deck, n, candidates, rng, coherent)
+            if prefilter and catalog.Hopeless(shadow_deck.deck, shadow_deck.energy_zone):
+                if metrics is not None:
+                    metrics.Count("mutation.attempts")
+                    metrics.Count("mutation.prefiltered")
                 continue
+            shadow_decks.append(shadow_deck)
+            seeds.append(rng.getrandbits(64))
+        if not shadow_decks:
+            continue
+        
+        # Mutants after the first accepted one are dropped once it is found and come back as None.
+        if paired:
+            results = PairedEvaluations(shadow_decks, deck, cardPool, max(1, max_games // 2), seed = paired_seed, pool = pool,
+                                        parent_scores = parent_scores, until_first = True)
+            accepted = [result is not None and (result.decision == "better" or (result.decision is None and result.difference > 0))
+                        for result in results]
+        else:
+            results = SequentialEvaluations(shadow_decks, cardPool, deck, 50, max_games = max_games, seeds = seeds, pool = pool,
+                                            cache = cache, until_first = True)
+            accepted = [result is not None and (result.decision == "better" or (result.decision is None and result.winrate > 50))
+                        for result in results]
+        
+        if metrics is not None:
+            metrics.Count("mutation.attempts", sum(result is not None for result in results))
+        if any(accepted):
+            if metrics is not None:
+                metrics.Count("mutation.accepted")
+            return shadow_decks[accepted.index(True)]
+    
+    if metrics is not None:
+        metrics.Count("mutation.exhausted")
     
     return deck
 
 # This mutates the deck to swap out cards until it gets a better deck, the amount swapped out is determined by winrate.
-def Mutate(deck, winrate, cardPool):
+def Mutate(deck, winrate, cardPool, rng = random, pool = None, cache = None, paired = False):
     if winrate == 100:
         return deck
     elif winrate >= 75:
-        deck = NumberOfMutatedCards(deck, cardPool, 4)
+        deck = NumberOfMutatedCards(deck, cardPool, 4, rng, pool, cache = cache, paired = paired)
     elif winrate >= 50:
-        deck = NumberOfMutatedCards(deck, cardPool, 8)
+        deck = NumberOfMutatedCards(deck, cardPool, 8, rng, pool, cache = cache, paired = paired)
     elif winrate >= 25:
-        deck = NumberOfMutatedCards(deck, cardPool, 12)
+        deck = NumberOfMutatedCards(deck, cardPool, 12, rng, pool, cache = cache, paired = paired)
     else:
-        deck = NumberOfMutatedCards(deck, cardPool, 16)
+        deck = NumberOfMutatedCards(deck, cardPool, 16, rng, pool, cache = cache, paired = paired)
     return deck
 
 # Creates a random deck with a random energy_pool, this is used to provide the nueral network with immediate/easy/unsure of what word to use here data.
-def GenerateRandomDecks(cardPool, size = 1):
+# Every deck is built valid by FillDeck(), coherent biases the decks towards full evolution lines that match their energy zone.
+# With prefilter set, decks that could never attack (see DeckAnalytics.Hopeless()) are thrown away and built again.
+def GenerateRandomDecks(cardPool, size = 1, rng = random, coherent = False, prefilter = False):
+    catalog = GetCatalog()
+    candidates = catalog.PoolIndices(cardPool)
     decks = []
     
     while len(decks) < size:
-        deck_ids = [card["id"] for card in random.choices(cardPool, k = 20)]
-        energy_zone = random.choices(["Grass", "Fire", "Water", "Electric", "Psychic", "Fighting", "Dark", "Metal"], k = random.randint(1, 3))
-        player = Player(deck_ids, energy_zone)
-        if player.DeckValidation() == True:
-            if size == 1:
-                return player
-            elif size > 1:
-                decks.append(player)
+        energy_zone = [ENERGY_INDEX[energy_type] for energy_type in rng.choices(ENERGY_TYPES, k = rng.randint(1, 3))]
+        deck = FillDeck((), energy_zone, candidates, rng, coherent)
+        if prefilter and catalog.Hopeless(deck, energy_zone):
+            if metrics is not None:
+                metrics.Count("generation.prefiltered")
+            continue
+        player = Player(deck, energy_zone)
+        if size == 1:
+            return player
+        decks.append(player)
     
     return decks
 
+# Derives the seed of a single game (or any other sub-task) from a master seed, the same keys always give the same seed.
+def DeriveSeed(seed, *keys):
+    text = ":".join(str(key) for key in (seed,) + keys)
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size = 8).digest(), "big")
+
+# Plays one game where the coin flip, each player's shuffles and energy and a random opponent (when no opponent deck is given)
+# all come from their own stream derived from the seed, so the result only depends on the decks and the seed.
+# Raises ValueError (from StartDeckDraw()) if either deck breaks the deck rules.
+def SeededBattle(deck, energy_zone, opponent_deck, opponent_energy_zone, seed, logger = None, cardPool = None):
+    player1 = Player(deck, energy_zone, random.Random(DeriveSeed(seed, "player1")))
+    if opponent_deck is None:
+        opponent = GenerateRandomDecks(cardPool or GetCatalog().cards, 1, random.Random(DeriveSeed(seed, "opponent")))
+        opponent_deck, opponent_energy_zone = opponent.deck, opponent.energy_zone
+    player2 = Player(opponent_deck, opponent_energy_zone, random.Random(DeriveSeed(seed, "player2")))
+    
+    return Battle(player1, player2, logger, random.Random(DeriveSeed(seed, "game")))
+
+# Plays one independent game, a job is (deck, energy_zone, opponent_deck, opponent_energy_zone, seed).
+# The result only depends on the job and not on which process plays it or in what order.
+def PlayGame(job, cardPool = None):
+    deck, energy_zone, opponent_deck, opponent_energy_zone, seed = job
+    
+    return SeededBattle(deck, energy_zone, opponent_deck, opponent_energy_zone, seed, None, cardPool).winner
+
+# Sets up a worker process with the same cards as the process that started it.
+def InitWorker(cards):
+    SetCatalog(CardCatalog(cards))
+    
+    return
+
+# Plays a chunk of jobs in a worker, returning the winners and the metrics counted and turn phases timed while playing them.
+# pool_indices are the catalog indices of the card pool random opponents are drawn from, None for every card.
+def PlayChunk(jobs, collect_metrics = False, time_phases = False, pool_indices = None):
+    collector = EnableMetrics() if collect_metrics else DisableMetrics()
+    timer = EnablePhaseTiming() if time_phases else DisablePhaseTiming()
+    cardPool = [GetCatalog().cards[card] for card in pool_indices] if pool_indices is not None else None
+    winners = [PlayGame(job, cardPool) for job in jobs]
+    
+    return winners, (dict(collector.counts) if collector is not None else None), (timer.State() if timer is not None else None)
+
+# Plays a list of PlayGame() jobs, in this process or spread over an EvaluationPool, returning the winner of each.
+def PlayGames(jobs, cardPool = None, pool = None):
+    if pool is None:
+        return [PlayGame(job, cardPool) for job in jobs]
+    
+    return pool.Map(jobs, cardPool)
+
+# A pool of worker processes for playing independent games in parallel.
+# Every game is seeded on its own, so the results are identical for any number of workers and any chunksize.
+class EvaluationPool:
+    def __init__(self, workers = None, chunksize = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunksize = chunksize # games sent to a worker at a time, by default a few chunks per worker
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.workers, initializer = InitWorker,
+                                                               initargs = (GetCatalog().cards,))
+    
+    # Plays the jobs on the workers, the games' metrics and phase timings are collected in the workers and added to this process's.
+    # Random opponents are drawn from cardPool, sent to the workers as catalog indices.
+    def Map(self, jobs, cardPool = None):
+        chunksize = self.chunksize or max(1, len(jobs) // (self.workers * 4))
+        chunks = [jobs[i:i + chunksize] for i in range(0, len(jobs), chunksize)]
+        collect_metrics = metrics is not None
+        time_phases = phase_timer is not None
+        pool_indices = None if cardPool is None or cardPool is GetCatalog().cards else GetCatalog().PoolIndices(cardPool)
+        
+        winners = []
+        for (chunk_winners, counts, timings) in self.executor.map(PlayChunk, chunks, itertools.repeat(collect_metrics),
+                                                                  itertools.repeat(time_phases), itertools.repeat(pool_indices)):
+            winners.extend(chunk_winners)
+            if counts:
+                metrics.Merge(counts)
+            if timings:
+                phase_timer.Merge(timings)
+        
+        return winners
+    
+    def Close(self):
+        self.executor.shutdown()
+        
+        return
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.Close()
+
+# Evaluates several decks at once, returning the win rate of each.
+# All the games are played as one batch so a pool can spread every deck's games over its workers.
+# With a MatchupCache only the games a matchup is missing to reach n are played, and the win rate covers every game recorded for it.
+def EvaluateDecks(decks, cardPool, n = 10, deck2 = None, seed = None, pool = None, cache = None):
+    if seed is None:
+        seed = random.getrandbits(64)
+    
+    jobs = []
+    counts = []
+    for (i, deck) in enumerate(decks):
+        start = min(cache.Get(deck.signature, OpponentSignature(deck2))[2], n) if cache is not None else 0
+        jobs.extend(EvaluationJobs(deck, deck2, seed, i, start, n))
+        counts.append(n - start)
+    
+    winners = PlayGames(jobs, cardPool, pool)
+    
+    if cache is None:
+        return [(winners[i * n:(i + 1) * n].count("player1") / n) * 100 for i in range(len(decks))]
+    
+    winrates = []
+    played = 0
+    for (deck, count) in zip(decks, counts):
+        deck_winners = winners[played:played + count]
+        played += count
+        cache.Add(deck.signature, OpponentSignature(deck2), deck_winners.count("player1"), deck_winners.count(None), count)
+        wins, draws, games = cache.Get(deck.signature, OpponentSignature(deck2))
+        winrates.append((wins / games) * 100)
+    
+    return winrates
+
+# The MatchupCache signature of an opponent deck, or of random opponents.
+def OpponentSignature(deck2):
+    return deck2.signature if deck2 != None else RANDOM_OPPONENT
+
+# The PlayGame() jobs for games start to stop of a deck's evaluation, i is the deck's position in EvaluateDecks().
+def EvaluationJobs(deck, deck2, seed, i, start, stop):
+    if deck2 != None:
+        return [(deck.deck, deck.energy_zone, deck2.deck, deck2.energy_zone, DeriveSeed(seed, i, j)) for j in range(start, stop)]
+    
+    return [(deck.deck, deck.energy_zone, None, None, DeriveSeed(seed, i, j)) for j in range(start, stop)]
+
 # Evaluates each deck by making it battle random decks.
-def DeckEvaluation(deck, cardPool, n = 10, deck2 = None):
-    wins = 0
+# When deck2 is given the deck battles it instead, every game is seeded from seed (a random one if not given).
+def DeckEvaluation(deck, cardPool, n = 10, deck2 = None, seed = None, pool = None, cache = None):
+    return EvaluateDecks([deck], cardPool, n, deck2, seed, pool, cache)[0]
+
+# The Wilson score interval of a win rate, as percentages, z = 1.96 gives a 95% interval.
+def WilsonInterval(wins, games, z = 1.96):
+    if games == 0:
+        return (0.0, 100.0)
+    
+    rate = wins / games
+    centre = (rate + z * z / (2 * games)) / (1 + z * z / games)
+    spread = (z / (1 + z * z / games)) * math.sqrt(rate * (1 - rate) / games + z * z / (4 * games * games))
+    
+    return (max(0.0, centre - spread) * 100, min(1.0, centre + spread) * 100)
+
+# The result of SequentialEvaluation().
+class EvaluationResult:
+    __slots__ = ("wins", "games", "winrate", "interval", "decision")
     
-    for i in range(n):
-        if deck2 != None:
-            mutated_deck = Player(deck.deck[:], deck.energy_zone[:])
-            original_deck = Player(deck2.deck[:], deck2.energy_zone[:])
+    def __init__(self, wins, games, decision):
+        self.wins = wins
+        self.games = games
+        self.winrate = (wins / games) * 100 if games else 0.0
+        self.interval = WilsonInterval(wins, games) # 95% interval of the win rate
+        self.decision = decision # "better", "worse" or None if the budget ran out first
+    
+    # Dictionary that can be put into json files.
+    def to_dict(self):
+        return {
+            "wins": self.wins,
+            "games": self.games,
+            "winrate": self.winrate,
+            "interval": list(self.interval),
+            "decision": self.decision
+            }
+
+# Evaluates a deck in batches of games and stops as soon as it is clearly better or worse than threshold% win rate,
+# instead of always playing a fixed number of games.
+# This is a sequential probability ratio test of a win rate of threshold + margin against threshold - margin,
+# alpha is the chance of calling a deck better when it is at threshold - margin and beta the chance of the reverse.
+# Draws count as not winning, like DeckEvaluation(). The games use the same seeds as DeckEvaluation() with the same seed.
+# With a MatchupCache the test starts from the games already recorded for the matchup, and the new games are added to it.
+def SequentialEvaluation(deck, cardPool, deck2 = None, threshold = 50, margin = 15, alpha = 0.05, beta = 0.05,
+                         max_games = 30, batch = 5, seed = None, pool = None, cache = None):
+    if seed is None:
+        seed = random.getrandbits(64)
+    
+    return SequentialEvaluations([deck], cardPool, deck2, threshold, margin, alpha, beta, max_games, batch, [seed], pool, cache)[0]
+
+# Runs SequentialEvaluation() on several decks side by side, deck i with seeds[i], returning an EvaluationResult for each.
+# Each round the next batch of every deck still being tested is played in one PlayGames() call.
+# With until_first set the decks after the first accepted one (found better, or above threshold when max_games ran out)
+# stop being played as soon as it is accepted and come back as None, for looking for the first better deck of several.
+def SequentialEvaluations(decks, cardPool, deck2 = None, threshold = 50, margin = 15, alpha = 0.05, beta = 0.05,
+                          max_games = 30, batch = 5, seeds = None, pool = None, cache = None, until_first = False):
+    if seeds is None:
+        seeds = [random.getrandbits(64) for deck in decks]
+    
+    worse_rate = min(max((threshold - margin) / 100, 0.001), 0.998)
+    better_rate = min(max((threshold + margin) / 100, worse_rate + 0.001), 0.999)
+    win_step = math.log(better_rate / worse_rate)
+    loss_step = math.log((1 - better_rate) / (1 - worse_rate))
+    upper = math.log((1 - beta) / alpha)
+    lower = math.log(beta / (1 - alpha))
+    
+    # Checks the test after each batch, starting with what is already known.
+    def Decide(wins, games):
+        log_ratio = wins * win_step + (games - wins) * loss_step
+        if log_ratio >= upper:
+            return "better"
+        elif log_ratio <= lower:
+            return "worse"
+        return None
+    
+    known = [cache.Get(deck.signature, OpponentSignature(deck2)) if cache is not None else (0, 0, 0) for deck in decks]
+    wins = [deck_wins for (deck_wins, deck_draws, deck_games) in known]
+    games = [deck_games for (deck_wins, deck_draws, deck_games) in known]
+    new_wins = [0] * len(decks)
+    new_draws = [0] * len(decks)
+    decisions = [Decide(wins[i], games[i]) if games[i] else None for i in range(len(decks))]
+    
+    def Finished(i):
+        return decisions[i] is not None or games[i] >= max_games
+    
+    def Accepted(i):
+        return Finished(i) and (decisions[i] == "better" or (decisions[i] is None and games[i] and wins[i] / games[i] * 100 > threshold))
+    
+    tested = len(decks) # the decks from tested on are not played any more
+    while True:
+        if until_first:
+            tested = next((i + 1 for i in range(len(decks)) if Accepted(i)), len(decks))
+        playing = [i for i in range(tested) if not Finished(i)]
+        if not playing:
+            break
+        
+        stops = [min(games[i] + batch, max_games) for i in playing]
+        jobs = [job for (i, stop) in zip(playing, stops) for job in EvaluationJobs(decks[i], deck2, seeds[i], 0, games[i], stop)]
+        winners = PlayGames(jobs, cardPool, pool)
+        played = 0
+        for (i, stop) in zip(playing, stops):
+            deck_winners = winners[played:played + stop - games[i]]
+            played += stop - games[i]
+            wins[i] += deck_winners.count("player1")
+            new_wins[i] += deck_winners.count("player1")
+            new_draws[i] += deck_winners.count(None)
+            games[i] = stop
             
-            log = Battle(mutated_deck, original_deck)
-        else:
-            evaluating_deck = Player(deck.deck[:], deck.energy_zone[:])
-            random_opponent = GenerateRandomDecks(cardPool)
+            decisions[i] = Decide(wins[i], games[i])
+    
+    for (i, deck) in enumerate(decks):
+        played = games[i] - known[i][2]
+        if cache is not None:
+            cache.Add(deck.signature, OpponentSignature(deck2), new_wins[i], new_draws[i], played)
+        if metrics is not None:
+            metrics.Count("evaluation.sequential_games", played)
+            if i < tested:
+                metrics.Count("evaluation.decision_" + (decisions[i] or "undecided"))
+    
+    return [EvaluationResult(wins[i], games[i], decisions[i]) if i < tested else None for i in range(len(decks))]
+
+# The result of PairedEvaluation(), differences are in win rate percentage points of the deck over the parent.
+class PairedResult:
+    __slots__ = ("pairs", "games", "difference", "stderr", "interval", "decision", "winrate", "parent_winrate")
+    
+    def __init__(self, deck_scores, parent_scores, games, z, decision):
+        pairs = len(deck_scores)
+        differences = [deck_score - parent_score for (deck_score, parent_score) in zip(deck_scores, parent_scores)]
+        mean = sum(differences) / pairs if pairs else 0.0
+        variance = sum((difference - mean) ** 2 for difference in differences) / (pairs - 1) if pairs > 1 else 1.0
+        
+        self.pairs = pairs
+        self.games = games # games the deck played, the parent's games are not counted when they were reused
+        self.difference = mean * 100
+        self.stderr = math.sqrt(variance / pairs) * 100 if pairs else 100.0
+        self.interval = (self.difference - z * self.stderr, self.difference + z * self.stderr)
+        self.decision = decision # "better", "worse" or None if the budget ran out first
+        self.winrate = (sum(deck_scores) / pairs) * 100 if pairs else 0.0
+        self.parent_winrate = (sum(parent_scores) / pairs) * 100 if pairs else 0.0
+    
+    # Dictionary that can be put into json files.
+    def to_dict(self):
+        return {
+            "pairs": self.pairs,
+            "games": self.games,
+            "difference": self.difference,
+            "stderr": self.stderr,
+            "interval": list(self.interval),
+            "decision": self.decision,
+            "winrate": self.winrate,
+            "parent_winrate": self.parent_winrate
+            }
+
+# The games of pair k of a paired evaluation: one random opponent, played once with the deck as player1 and once as player2,
+# both from seeds that only depend on seed and k. Returns the deck's score, 0 to 1, with draws counting as not winning.
+def PairedJobs(deck, seed, k, cardPool):
+    opponent = GenerateRandomDecks(cardPool or GetCatalog().cards, 1, random.Random(DeriveSeed(seed, k, "opponent")))
+    
+    return [(deck.deck, deck.energy_zone, opponent.deck, opponent.energy_zone, DeriveSeed(seed, k, "first")),
+            (opponent.deck, opponent.energy_zone, deck.deck, deck.energy_zone, DeriveSeed(seed, k, "second"))]
+
+def PairedScore(winners):
+    return ((winners[0] == "player1") + (winners[1] == "player2")) / 2
+
+# Compares a deck with its parent using common random numbers: both play the same random opponents, in both seats,
+# with the same shuffle, coin flip and energy streams, so most of the luck cancels out of the difference between them.
+# Pairs are played batch at a time until the z-interval of the mean difference is above or below 0 (after at least batch pairs),
+# or max_pairs have been played. parent_scores is a dictionary that keeps the parent's pair scores so that several
+# deck evaluations against the same parent and seed only play the parent's games once.
+def PairedEvaluation(deck, parent, cardPool, max_pairs = 15, batch = 5, z = 1.96, seed = None, pool = None, parent_scores = None):
+    return PairedEvaluations([deck], parent, cardPool, max_pairs, batch, z, seed, pool, parent_scores)[0]
+
+# Runs PairedEvaluation() on several decks against the same parent side by side, returning a PairedResult for each.
+# Each round the next batch of pairs of every deck still being compared, and the parent's pairs that are missing,
+# are played in one PlayGames() call. With until_first set the decks after the first accepted one (found better,
+# or ahead of the parent when max_pairs ran out) stop being played as soon as it is accepted and come back as None.
+def PairedEvaluations(decks, parent, cardPool, max_pairs = 15, batch = 5, z = 1.96, seed = None, pool = None, parent_scores = None,
+                      until_first = False):
+    if seed is None:
+        seed = random.getrandbits(64)
+    if parent_scores is None:
+        parent_scores = {}
+    
+    deck_scores = [[] for deck in decks]
+    games = [0] * len(decks)
+    decisions = [None] * len(decks)
+    results = [None] * len(decks)
+    
+    def Finished(i):
+        return decisions[i] is not None or len(deck_scores[i]) >= max_pairs
+    
+    def Accepted(i):
+        return Finished(i) and results[i] is not None and (decisions[i] == "better" or (decisions[i] is None and results[i].difference > 0))
+    
+    tested = len(decks) # the decks from tested on are not played any more
+    while True:
+        if until_first:
+            tested = next((i + 1 for i in range(len(decks)) if Accepted(i)), len(decks))
+        playing = [i for i in range(tested) if not Finished(i)]
+        if not playing:
+            break
         
-            log = Battle(evaluating_deck, random_opponent)
+        pairs = [range(len(deck_scores[i]), min(len(deck_scores[i]) + batch, max_pairs)) for i in playing]
+        new_parent_pairs = sorted({k for deck_pairs in pairs for k in deck_pairs if k not in parent_scores})
+        jobs = [job for (i, deck_pairs) in zip(playing, pairs) for k in deck_pairs for job in PairedJobs(decks[i], seed, k, cardPool)]
+        played = len(jobs) // 2
+        jobs += [job for k in new_parent_pairs for job in PairedJobs(parent, seed, k, cardPool)]
+        winners = PlayGames(jobs, cardPool, pool)
         
-        if log[-1]["winner"] == "player1":
-            wins += 1
-            print(wins)
+        for (j, k) in enumerate(new_parent_pairs, played):
+            parent_scores[k] = PairedScore(winners[2 * j:2 * j + 2])
+        j = 0
+        for (i, deck_pairs) in zip(playing, pairs):
+            deck_scores[i] += [PairedScore(winners[2 * (j + m):2 * (j + m) + 2]) for m in range(len(deck_pairs))]
+            j += len(deck_pairs)
+            games[i] += 2 * len(deck_pairs)
+            
+            results[i] = PairedResult(deck_scores[i], [parent_scores[k] for k in range(len(deck_scores[i]))], games[i], z, None)
+            if results[i].interval[0] > 0:
+                decisions[i] = "better"
+            elif results[i].interval[1] < 0:
+                decisions[i] = "worse"
     
-    winrate = (wins / n) * 100
-    if winrate >= 0.2 * 100:
-        print("Good Deck.")
-        print("Win Rate is {}%.".format(winrate))
+    if metrics is not None:
+        metrics.Count("evaluation.paired_games", sum(games))
+        for i in range(tested):
+            metrics.Count("evaluation.paired_decision_" + (decisions[i] or "undecided"))
     
-    return winrate
+    return [PairedResult(deck_scores[i], [parent_scores[k] for k in range(len(deck_scores[i]))], games[i], z, decisions[i])
+            if i < tested else None for i in range(len(decks))]
 
 # Creates generations that begin with 2^n (number of generations), this is a sort of lastman standing type of elimination of the worst decks.
-def Generations(generations, cardPool):
-    decks_generated = GenerateRandomDecks(cardPool, pow(2, generations))
-    
-    for i in range(generations):
-        winrates = []
-        
-        for j in range(len(decks_generated)):
-            winrates.append(DeckEvaluation(decks_generated[j], cardPool))
-        
-        range_for_k = int(len(decks_generated) / 2)
-        for k in range(range_for_k):
-            if winrates[k + 1] < winrates[k]:
-                decks_generated[k] = Mutate(decks_generated[k], winrates[k], cardPool)
-                
-                decks_generated.pop(k + 1)
-                winrates.pop(k + 1)
-            elif winrates[k + 1] > winrates[k]:
-                decks_generated[k + 1] = Mutate(decks_generated[k + 1], winrates[k + 1], cardPool)
-                
-                decks_generated.pop(k)
-                winrates.pop(k)
-            elif winrates[k + 1] == winrates[k]: # as one of them have to be done away with I decided to get rid of [k + 1]
-                decks_generated[k] = Mutate(decks_generated[k], winrates[k], cardPool)
-                
-                decks_generated.pop(k + 1)
-                winrates.pop(k + 1)
-    
-    print(decks_generated)
-    print(winrates)
-    return decks_generated[0]
+# Passing a seed makes the whole run reproducible, and passing an EvaluationPool plays the games in parallel.
+# A MatchupCache lets decks that survive a generation keep the games they have already played.
+# With a tournament format ("round-robin" or "swiss") the decks are ranked by playing each other in a tournament
+# with tournament_games games per pairing, instead of each playing 10 random decks.
+# With paired set mutants are compared with their parent by PairedEvaluation() instead of playing against it.
+# With a checkpoint path the run is saved there at the start of every generation and can be continued with ResumeGenerations().
+# progress is called with the number of generations played and the number of generations at the start of every generation and at the end.
+# With selection "elitist" the bracket is replaced by selection.py's SelectionGeneration(): population decks (2^generations by default)
+# are kept every generation, the best elites of them survive as they are and the rest are bred by tournament selection
+# of tournament_size decks, crossover with chance crossover_rate and mutation of mutation_cards cards.
+# population and elites are only for elitist runs, a bracket always starts with 2^generations decks.
+def Generations(generations, cardPool, seed = None, pool = None, cache = None, tournament_format = None, tournament_games = 2,
+                checkpoint = None, paired = False, progress = None, selection = "bracket", population = None, elites = None,
+                tournament_size = 3, crossover_rate = 0.5, mutation_cards = 3):
+    if selection not in ("bracket", "elitist"):
+        raise ValueError("Unknown selection {!r}, expected bracket or elitist".format(selection))
+    if selection == "bracket" and (population is not None or elites is not None):
+        raise ValueError("population and elites are only for elitist selection, a bracket starts with 2^generations decks")
+    if population is not None and population < 2:
+        raise ValueError("An elitist population needs at least 2 decks")
+    if elites is not None and not 1 <= elites <= (population or pow(2, generations)):
+        raise ValueError("elites must be between 1 and the population, the run returns its best elite")
+    
+    rng = random.Random(seed) if seed is not None else random
+    population = population or pow(2, generations)
+    decks_generated = GenerateRandomDecks(cardPool, population, rng, prefilter = True)
+    decks_generated = decks_generated if isinstance(decks_generated, list) else [decks_generated]
+    settings = {"tournament_format": tournament_format, "tournament_games": tournament_games, "paired": paired, "selection": selection}
+    if selection == "elitist":
+        from selection import Deduplicate
+        decks_generated = Deduplicate(decks_generated, cardPool, rng)
+        settings.update({"population": population, "elites": elites if elites is not None else max(1, population // 8),
+                         "tournament_size": tournament_size, "crossover_rate": crossover_rate, "mutation_cards": mutation_cards})
+    
+    return RunGenerations(generations, 0, decks_generated, [], rng, cardPool, pool, cache, settings, checkpoint, progress)
+
+# Continues a Generations() run from its checkpoint file. Without a cache the run carries on exactly as it would have
+# without stopping, a cache may hold games played after the checkpoint was saved.
+def ResumeGenerations(checkpoint, cardPool, pool = None, cache = None, progress = None):
+    state = LoadCheckpoint(checkpoint)
+    rng = random.Random()
+    version, internal_state, gauss_next = state["rng"]
+    rng.setstate((version, tuple(internal_state), gauss_next))
+    decks_generated = [Player(deck, energy_zone) for (deck, energy_zone) in state["population"]]
+    
+    return RunGenerations(state["generations"], state["generation"], decks_generated, state["winrates"], rng, cardPool, pool,
+                          cache, state["settings"], checkpoint, progress, state.get("records"))
+
+# Plays generations first_generation to generations of a run, settings holds the options given to Generations().
+# With elitist selection records are the [wins, games] of the elites at the front of the population, see selection.py's
+# PlayGeneration(), and winrates are their win rates.
+def RunGenerations(generations, first_generation, decks_generated, winrates, rng, cardPool, pool, cache, settings, checkpoint,
+                   progress = None, records = None):
+    tournament_format = settings["tournament_format"]
+    paired = settings["paired"]
+    elitist = settings.get("selection", "bracket") == "elitist" # checkpoints from before selections only have brackets
+    records = records or []
+    
+    for i in range(first_generation, generations):
+        if progress is not None:
+            progress(i, generations)
+        if checkpoint is not None:
+            SaveCheckpoint(checkpoint, generations, i, decks_generated, winrates, rng, settings, cache, records if elitist else None)
         
+        if elitist:
+            from selection import PlayGeneration, SelectionGeneration
+            records = PlayGeneration(decks_generated, records, cardPool, rng, pool, cache, settings)
+            decks_generated, records = SelectionGeneration(decks_generated, records, cardPool, rng, settings)
+            winrates = [(wins / games) * 100 for (wins, games) in records]
+            continue
+        
+        if tournament_format is not None:
+            from tournament import Tournament # tournament.py imports this module
+            winrates = Tournament(decks_generated, cardPool, settings["tournament_games"], tournament_format, None,
+                                  rng.getrandbits(64), pool, cache).WinRates()
+        else:
+            winrates = EvaluateDecks(decks_generated, cardPool, 10, None, rng.getrandbits(64), pool, cache)
+        
+        # The better deck of each pair is kept and mutated, as one of them has to be done away with on a tie the first one is kept.
+        # Every pair's mutation has its own random generator, so with a pool the pairs are mutated at the same time
+        # and the result doesn't depend on which pair finishes first. A cache is only used from one thread, so with one
+        # the pairs are mutated one after another.
+        pairs_seed = rng.getrandbits(64)
+        survivors = [k if winrates[k] >= winrates[k + 1] else k + 1 for k in range(0, len(decks_generated) - 1, 2)]
+        
+        def MutateSurvivor(k):
+            return Mutate(decks_generated[k], winrates[k], cardPool, random.Random(DeriveSeed(pairs_seed, k)), pool, cache, paired)
+        
+        if pool is not None and cache is None:
+            with concurrent.futures.ThreadPoolExecutor(pool.workers) as executor:
+                mutants = list(executor.map(MutateSurvivor, survivors))
+        else:
+            mutants = [MutateSurvivor(k) for k in survivors]
+        decks_generated = mutants
+        winrates = [winrates[k] for k in survivors]
+    
+    if progress is not None:
+        progress(generations, generations)
+    if checkpoint is not None:
+        SaveCheckpoint(checkpoint, generations, generations, decks_generated, winrates, rng, settings, cache, records if elitist else None)
+    
+    return decks_generated[0]
+
+# Saves the state of a Generations() run as gzipped json: the population, the win rates it was last ranked by,
+# the random generator, the generation it is about to play, the run's settings and, with elitist selection,
+# the elites' [wins, games] records. The file is written next to the old one
+# and then swapped in, so a run stopped while saving still has its previous checkpoint.
+def SaveCheckpoint(path, generations, generation, decks_generated, winrates, rng, settings, cache = None, records = None):
+    version, internal_state, gauss_next = rng.getstate()
+    state = {
+        "generations": generations,
+        "generation": generation,
+        "population": [[deck.deck_ids, deck.energy_names] for deck in decks_generated],
+        "winrates": winrates,
+        "rng": [version, list(internal_state), gauss_next],
+        "settings": settings
+        }
+    if records is not None:
+        state["records"] = records
+    
+    if cache is not None:
+        cache.Flush()
+    
+    temporary_path = path + ".tmp"
+    with gzip.open(temporary_path, "wt") as f:
+        json.dump(state, f, separators = (",", ":"))
+    os.replace(temporary_path, path)
+    
+    return
+
+def LoadCheckpoint(path):
+    with gzip.open(path, "rt") as f:
+        return json.load(f)
 
 # What will actually happen when each battle begins and is processed.
-def Battle(player1, player2):
-    battle_log = [] # a log for the battle that will happen
+# Returns a BattleOutcome, turn by turn records are only built when a BattleLogger is passed in.
+def Battle(player1, player2, logger = None, rng = random):
     turn = 1
+    evolves_from = catalog.evolves_from_index
+    move_tables = catalog.move_tables
+    timer = phase_timer
+    if timer is not None:
+        lap = time.perf_counter_ns()
     
-    GameBegin(player1, player2)
-    
-    # Puts a basic pokemon in the active spot.
-    looking1 = True
-    while looking1:
-        # Checks for the basic Pokemon.
-        hand_lookup = {card["id"]: card for card in cardPool} # creates a dictionary of the hand cards
-        for card_id in player1.hand:
-            if(hand_lookup[card_id].get("evolutionStage") == 0): # checks if the hand contains a basic Pokemon
-                potentialactive1 = card_id
-                looking1 = False # in order to stop the while loop
-                break
+    GameBegin(player1, player2, rng)
     
-    # Puts a basic pokemon in the active spot.
-    looking2 = True
-    while looking2:
-        # Checks for the basic Pokemon.
-        hand_lookup = {card["id"]: card for card in cardPool} # creates a dictionary of the hand cards
-        for card_id in player2.hand:
-            if(hand_lookup[card_id].get("evolutionStage") == 0): # checks if the hand contains a basic Pokemon
-                potentialactive2 = card_id
-                looking2 = False # in order to stop the while loop
-                break
+    # Puts the first basic Pokemon of each hand in the active spot, StartDeckDraw() always deals a hand with one.
+    is_basic = catalog.is_basic
+    potentialactive1 = next(card for card in player1.hand if is_basic[card])
+    potentialactive2 = next(card for card in player2.hand if is_basic[card])
     
     PokemonActive(player1, potentialactive1)
     PokemonActive(player2, potentialactive2)
     
+    if logger is not None:
+        logger.BeginGame(player1, player2)
+    if timer is not None:
+        lap = timer.Lap("setup", lap)
+    
     # These are set to the inverse as the while loop will swap positions.
     if player1.startplayer == True:
         offender = player2
@@ -440,79 +1436,83 @@ def Battle(player1, player2):
         
         # In case no basic Pokemon replacement was found for some reason
         if (offender.active_pokemon == None) or (defender.active_pokemon == None):
-            battle_log.append(RecordCurrentGameState(defender, offender, turn, "win/lose"))
-            print("Something Happened @ not battleWon beginning")
-            print(turn - 1)
-            return battle_log
-            
+            return EndBattle(logger, player1, player2, defender, offender, turn, "win/lose", None, "no active")
+        
         # What happens every turn.
         Player.DeckDraw(offender, 1)
+        if timer is not None:
+            lap = timer.Lap("draw", lap)
         if turn != 1:
             EnergyZoneGeneration(offender)
             Pokemon.AttachEnergy(offender.active_pokemon, offender.energy_generated, 1)
             offender.energy_generated = None
+        if timer is not None:
+            lap = timer.Lap("energy", lap)
+        
+        # Check if evolution possible, and evolve (the hand is searched again after each evolution so a whole line can evolve at once).
+        evolving = True
+        while evolving:
+            evolving = False
+            for card in offender.hand:
+                if evolves_from[card] == offender.active_pokemon.card:
+                    offender.hand.remove(card)
+                    offender.active_pokemon.Evolve(card)
+                    evolving = True
+                    break
+        if timer is not None:
+            lap = timer.Lap("evolution", lap)
         
-        # Check if evolution possible, and evolve.
-        hand_lookup = {card["id"]: card for card in cardPool}
-        for card_id in offender.hand:
-            if hand_lookup[card_id].get("evolvesFrom") == offender.active_pokemon.id:
-                reduced_hp = offender.active_pokemon.max_hp - offender.active_pokemon.current_hp
-                attached_energy = offender.active_pokemon.attached_energy
-                status_condition = offender.active_pokemon.status_condition
-                
-                offender.hand.remove(card_id)
-                offender.active_pokemon = Pokemon(hand_lookup.get(card_id))
-                
-                offender.active_pokemon.current_hp = offender.active_pokemon.max_hp - reduced_hp
-                offender.active_pokemon.attached_energy = attached_energy
-                offender.active_pokemon.status_condition = status_condition
-        
-        # Chooses the first damaging move and uses it.
-        for move in offender.active_pokemon.moves:
-            if move.get("damage") > 0 and CanUseMove(offender.active_pokemon, move):
-                Pokemon.PokemonDamage(offender.active_pokemon, defender.active_pokemon, move.get("damage"))
+        # Chooses the highest damage move the attached energy can pay for and uses it.
+        attacker = offender.active_pokemon
+        damage = move_tables[attacker.card].get(attacker.energy_code)
+        if damage is None:
+            damage = catalog.BestUsableDamage(attacker.card, attacker.energy_code, attacker.attached_energy)
+        if damage > 0:
+            Pokemon.PokemonDamage(attacker, defender.active_pokemon, damage)
+        if timer is not None:
+            lap = timer.Lap("move", lap)
         
         # Attributes points depending on if the defeating Pokemon was an ex or not.
         if defender.active_pokemon.current_hp <= 0:
-            if defender.active_pokemon.name.endswith(" ex"):
+            if catalog.is_ex[defender.active_pokemon.card]:
                 offender.points += 2
             else:
                 offender.points += 1
             
-            defender.discard_pile.append(defender.active_pokemon.id)
+            defender.discard_pile.append(defender.active_pokemon.card)
             defender.active_pokemon = None
+        if timer is not None:
+            lap = timer.Lap("knockout", lap)
         
         # Substitutes the old active -which is now discarded- with a new active Pokemon.
         if defender.active_pokemon == None:
             promoted = False
             
             # Checks for the basic Pokemon.
-            hand_lookup = {card["id"]: card for card in cardPool} # creates a dictionary of the hand cards
-            for card_id in defender.hand:
-                if(hand_lookup[card_id].get("evolutionStage") == 0): # checks for a basic Pokemon
-                    PokemonActive(defender, card_id)
+            for card in defender.hand:
+                if catalog.is_basic[card]: # checks for a basic Pokemon
+                    PokemonActive(defender, card)
                     promoted = True
                     break
+            if timer is not None:
+                lap = timer.Lap("promotion", lap)
             if not promoted:
                 if id(offender) == id(player1):
                     winner = "player1"
                 elif id(defender) == id(player1):
                     winner = "player2"
-                battle_log.append(RecordCurrentGameState(offender, defender, turn, "win/lose", winner))
-                print(offender.active_pokemon.name, "Won")
-                print(turn)
-                return battle_log
+                return EndBattle(logger, player1, player2, offender, defender, turn, "win/lose", winner, "knockout")
             else:
-                battle_log.append(RecordCurrentGameState(offender, defender, turn, "continued after promotion"))
+                if logger is not None:
+                    logger.Record(offender, defender, turn, "continued after promotion")
+                    if timer is not None:
+                        lap = timer.Lap("record", lap)
                 turn += 1
                 continue
         
         # To prevent infinite games.
         if turn == 50:
-            battle_log.append(RecordCurrentGameState(offender, defender, turn, "draw"))
-            print("Battle Drawn")
-            print(turn)
-            return battle_log
+            return EndBattle(logger, player1, player2, offender, defender, turn, "draw", None, "draw")
         
         # Checks if win condition (getting three points) is complete.
         if offender.points >= 3:
@@ -520,34 +1520,136 @@ def Battle(player1, player2):
                 winner = "player1"
             elif id(defender) == id(player1):
                 winner = "player2"
-            battle_log.append(RecordCurrentGameState(offender, defender, turn, "win/lose", winner))
-            print(offender.active_pokemon.name, "Won")
-            print(turn)
-            return battle_log
+            return EndBattle(logger, player1, player2, offender, defender, turn, "win/lose", winner, "points")
+        if timer is not None:
+            lap = timer.Lap("checks", lap)
         
-        battle_log.append(RecordCurrentGameState(offender, defender, turn, "ongoing"))
+        if logger is not None:
+            logger.Record(offender, defender, turn, "ongoing")
+            if timer is not None:
+                lap = timer.Lap("record", lap)
         
         turn += 1
+
+# Builds the BattleOutcome at the end of a battle and passes the final records to the logger.
+def EndBattle(logger, player1, player2, offender, defender, turn, result, winner, reason):
+    outcome = BattleOutcome(winner, turn, (player1.points, player2.points), reason)
     
-    return battle_log
+    if metrics is not None:
+        metrics.Count("games")
+        metrics.Count("turns", turn)
+        metrics.Count("result." + (winner or "draw"))
+        metrics.Count("end." + reason.replace(" ", "_"))
+    
+    if logger is not None:
+        logger.Record(offender, defender, turn, result, winner)
+        logger.EndGame(outcome)
+    
+    return outcome
 
-test = ["047", "047", "003", "003", "004", "004", "006", "006", "007", "007",
-        "009", "169", "010", "010", "012", "012", "005", "013", "226", "226"]
-test2 = ["001", "002", "003", "003", "004", "004", "006", "006", "007", "007",
-        "009", "169", "010", "010", "012", "012", "013", "013", "226", "226"]
-energy = ["Fire"]
-energy2 = ["Grass", "Water", "Fire"]
+# The library API, these take card ids and energy names and load the default card pool if no catalog is set.
 
-tester_deck = Player(test, energy)
+# Plays one game between two decks and returns its BattleOutcome, raises ValueError if either deck breaks the deck rules.
+def simulate(deck, energy_zone, opponent_deck, opponent_energy_zone, seed = None, logger = None):
+    ValidateDeck(Player(deck, energy_zone))
+    ValidateDeck(Player(opponent_deck, opponent_energy_zone))
+    if seed is None:
+        seed = random.getrandbits(64)
+    
+    return SeededBattle(deck, energy_zone, opponent_deck, opponent_energy_zone, seed, logger)
 
-DeckEvaluation(tester_deck, cardPool)
+# Returns the win rate of a deck against random decks, or against the opponent deck if one is given.
+# Raises ValueError if either deck breaks the deck rules.
+def evaluate(deck, energy_zone, games = 10, opponent_deck = None, opponent_energy_zone = None, seed = None, workers = 1):
+    player = ValidateDeck(Player(deck, energy_zone))
+    opponent = ValidateDeck(Player(opponent_deck, opponent_energy_zone)) if opponent_deck is not None else None
+    
+    with OptionalPool(workers) as pool:
+        return EvaluateDecks([player], GetCatalog().cards, games, opponent, seed, pool)[0]
 
-top_deck = Generations(5, cardPool)
+# Runs Generations() and returns the surviving deck as a Player.
+# With a checkpoint path the run is saved as it goes, and resume continues the run saved there instead of starting a new one.
+# selection, population and elites are passed on to Generations().
+def evolve(generations = 5, seed = None, workers = 1, cache = None, tournament_format = None, checkpoint = None, resume = False,
+           paired = False, selection = "bracket", population = None, elites = None):
+    with OptionalPool(workers) as pool:
+        if resume:
+            return ResumeGenerations(checkpoint, GetCatalog().cards, pool, cache)
+        return Generations(generations, GetCatalog().cards, seed, pool, cache, tournament_format, checkpoint = checkpoint,
+                           paired = paired, selection = selection, population = population, elites = elites)
 
-print("Before:", tester_deck.deck)
-tester_deck = Mutate(tester_deck, 55, cardPool)
-print("After:", tester_deck.deck)
+# An EvaluationPool when more than one worker is asked for, otherwise nothing is started and games are played in this process.
+@contextlib.contextmanager
+def OptionalPool(workers):
+    if workers is not None and workers <= 1:
+        yield None
+    else:
+        with EvaluationPool(workers) as pool:
+            yield pool
+
+# The command line demo: evaluates a test deck, runs the generations and appends the top deck to a json file.
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Simulates Pokemon TCG Pocket battles and evolves decks.")
+    parser.add_argument("--card-pool", default = DEFAULT_CARD_POOL_PATH, help = "card pool json to load")
+    parser.add_argument("--generations", type = int, default = 5, help = "the run starts with 2^generations decks")
+    parser.add_argument("--seed", type = int, default = None, help = "makes the run reproducible")
+    parser.add_argument("--workers", type = int, default = 1, help = "processes to play games in, 0 for one per core")
+    parser.add_argument("--output", default = "top_decks.json", help = "json file the top deck is appended to")
+    parser.add_argument("--cache", default = None, help = "SQLite file that keeps matchup results between runs")
+    parser.add_argument("--tournament", choices = ("round-robin", "swiss"), default = None,
+                        help = "rank each generation's decks by playing each other instead of random decks")
+    parser.add_argument("--paired", action = "store_true",
+                        help = "compare mutants with their parent on the same opponents and random streams")
+    parser.add_argument("--selection", choices = ("bracket", "elitist"), default = "bracket",
+                        help = "halve the decks every generation, or keep a constant population bred with elitism and crossover")
+    parser.add_argument("--population", type = int, default = None, help = "decks in an elitist population, 2^generations by default")
+    parser.add_argument("--elites", type = int, default = None, help = "best decks an elitist generation keeps, population / 8 by default")
+    parser.add_argument("--checkpoint", default = None, help = "file the generations are saved to as they run")
+    parser.add_argument("--resume", action = "store_true", help = "continue the run saved in the checkpoint file")
+    args = parser.parse_args(argv)
+    if args.resume and args.checkpoint is None:
+        parser.error("--resume needs --checkpoint")
+    if args.selection == "bracket" and (args.population is not None or args.elites is not None):
+        parser.error("--population and --elites need --selection elitist")
+    if args.population is not None and args.population < 2:
+        parser.error("--population must be at least 2")
+    if args.elites is not None and not 1 <= args.elites <= (args.population or pow(2, args.generations)):
+        parser.error("--elites must be between 1 and the population")
+    
+    SetCatalog(LoadCardCatalog(args.card_pool))
+    collector = EnableMetrics()
+    cardPool = catalog.cards
+    rng = random.Random(args.seed) if args.seed is not None else random
+    
+    test = ["047", "047", "003", "003", "004", "004", "006", "006", "007", "007",
+            "009", "169", "010", "010", "012", "012", "005", "013", "226", "226"]
+    energy = ["Fire"]
+    
+    tester_deck = Player(test, energy)
+    
+    with OptionalPool(args.workers or None) as pool, MatchupCache(path = args.cache) as cache:
+        winrate = DeckEvaluation(tester_deck, cardPool, 10, None, rng.getrandbits(64), pool, cache)
+        print("Test deck win rate is {}%.".format(winrate))
+        
+        generations_seed = rng.getrandbits(64)
+        if args.resume:
+            top_deck = ResumeGenerations(args.checkpoint, cardPool, pool, cache)
+        else:
+            top_deck = Generations(args.generations, cardPool, generations_seed, pool, cache, args.tournament, checkpoint = args.checkpoint,
+                                   paired = args.paired, selection = args.selection, population = args.population, elites = args.elites)
+        print("Top deck:", top_deck.deck_ids, top_deck.energy_names)
+        
+        print("Before:", tester_deck.deck_ids)
+        tester_deck = Mutate(tester_deck, 55, cardPool, rng, pool, cache, args.paired)
+        print("After:", tester_deck.deck_ids)
+    
+    with open(args.output, "a") as f:
+        json.dump(top_deck.to_dict(), f, indent = 2)
+        f.write("\n")
+    
+    print(collector.Report())
+    
+    return
 
-with open("top_decks.json", "a") as f:
-    json.dump(top_deck.to_dict(), f, indent = 2)
-    f.write("\n")
+if __name__ == "__main__":
+    main()
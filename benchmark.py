@@ -0,0 +1,335 @@
+# This program measures how fast parts of the simulator are.
+# Every benchmark runs at a fixed seed and size, so results can be saved as json and compared between commits.
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import battle_simulator
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+# The move check Battle() used before move tables: attached energy as a dictionary, copied for every move.
+def LegacyCanUseMove(attached_energy, move):
+    required = move["energyCost"]
+    attached = attached_energy.copy()
+    
+    # Checks if the required amount for each energy is present.
+    for energy_type, cost in required.items():
+        if energy_type != "Normal":
+            if attached.get(energy_type, 0) < cost:
+                return False
+            attached[energy_type] -= cost
+    
+    normal_energy_cost = required.get("Normal", 0)
+    total_left = sum(attached.values())
+    
+    # As normal energy is not an actual energy it checks it's cost against all remaining energies.
+    if normal_energy_cost > total_left:
+        return False
+    
+    return True
+
+# Times choosing the move to use for random Pokemon with random energy, the old way and with the catalog's move tables.
+def BenchmarkMoveSelection(samples = 100000, seed = 0):
+    catalog = battle_simulator.GetCatalog()
+    rng = random.Random(seed)
+    pokemon_cards = [card for card in catalog.all_indices if catalog.hp[card] and catalog.moves[card]]
+    
+    states = []
+    for i in range(samples):
+        pokemon = battle_simulator.Pokemon(rng.choice(pokemon_cards))
+        for j in range(rng.randrange(8)):
+            pokemon.AttachEnergy(rng.randrange(len(battle_simulator.ENERGY_TYPES)), 1)
+        states.append(pokemon)
+    legacy_states = [(catalog.cards[pokemon.card]["moves"], pokemon.to_dict()["attached_energy"]) for pokemon in states]
+    
+    start = time.perf_counter()
+    for (moves, attached) in legacy_states:
+        best = 0
+        for move in moves:
+            if move["damage"] > 0 and LegacyCanUseMove(attached, move) and move["damage"] > best:
+                best = move["damage"]
+    legacy_time = time.perf_counter() - start
+    
+    # The tables fill up as codes are first seen, so they are filled before timing like they are after the first few games.
+    move_tables = catalog.move_tables
+    for pokemon in states:
+        if pokemon.energy_code not in move_tables[pokemon.card]:
+            catalog.BestUsableDamage(pokemon.card, pokemon.energy_code, pokemon.attached_energy)
+    
+    start = time.perf_counter()
+    for pokemon in states:
+        damage = move_tables[pokemon.card].get(pokemon.energy_code)
+        if damage is None:
+            damage = catalog.BestUsableDamage(pokemon.card, pokemon.energy_code, pokemon.attached_energy)
+    table_time = time.perf_counter() - start
+    
+    return {
+        "samples": samples,
+        "seconds": legacy_time + table_time,
+        "legacy_seconds": legacy_time,
+        "table_seconds": table_time,
+        "speedup": legacy_time / table_time if table_time else float("inf")
+        }
+
+# Times whole battles between random decks.
+def BenchmarkBattles(games = 2000, seed = 0):
+    rng = random.Random(seed)
+    jobs = []
+    for i in range(games):
+        deck, opponent = battle_simulator.GenerateRandomDecks(None, 2, rng)
+        jobs.append((deck.deck, deck.energy_zone, opponent.deck, opponent.energy_zone, battle_simulator.DeriveSeed(seed, i)))
+    
+    start = time.perf_counter()
+    battle_simulator.PlayGames(jobs)
+    elapsed = time.perf_counter() - start
+    
+    return {
+        "games": games,
+        "seconds": elapsed,
+        "games_per_second": games / elapsed
+        }
+
+# Times single DeckEvaluation() calls of random decks against random opponents.
+def BenchmarkEvaluation(evaluations = 200, games = 10, seed = 0):
+    rng = random.Random(seed)
+    decks = battle_simulator.GenerateRandomDecks(None, evaluations, rng)
+    
+    latencies = []
+    for (i, deck) in enumerate(decks):
+        start = time.perf_counter()
+        battle_simulator.DeckEvaluation(deck, None, games, None, battle_simulator.DeriveSeed(seed, i))
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    
+    return {
+        "evaluations": evaluations,
+        "games_per_evaluation": games,
+        "seconds": sum(latencies),
+        "mean_latency": sum(latencies) / evaluations,
+        "median_latency": latencies[evaluations // 2],
+        "p95_latency": latencies[min(evaluations - 1, int(evaluations * 0.95))]
+        }
+
+# Times building valid random decks.
+def BenchmarkDeckGeneration(decks = 20000, seed = 0):
+    rng = random.Random(seed)
+    
+    start = time.perf_counter()
+    battle_simulator.GenerateRandomDecks(None, decks, rng)
+    elapsed = time.perf_counter() - start
+    
+    return {
+        "decks": decks,
+        "seconds": elapsed,
+        "decks_per_second": decks / elapsed
+        }
+
+# Times Mutate() on random decks, counting how many mutations were accepted.
+def BenchmarkMutation(mutations = 20, seed = 0):
+    rng = random.Random(seed)
+    decks = battle_simulator.GenerateRandomDecks(None, mutations, rng)
+    collector = battle_simulator.EnableMetrics()
+    
+    try:
+        start = time.perf_counter()
+        for deck in decks:
+            battle_simulator.Mutate(deck, 50, None, rng)
+        elapsed = time.perf_counter() - start
+    finally:
+        battle_simulator.DisableMetrics()
+    accepted = collector.counts["mutation.accepted"]
+    
+    return {
+        "mutations": mutations,
+        "accepted": accepted,
+        "attempts": collector.counts["mutation.attempts"],
+        "games": collector.counts["games"],
+        "seconds": elapsed,
+        "accepted_per_second": accepted / elapsed
+        }
+
+# Times a full Generations() run, split into the time spent ranking decks and mutating them.
+def BenchmarkGenerations(generations = 4, seed = 0):
+    stages = {"evaluation": 0.0, "mutation": 0.0}
+    originals = {"EvaluateDecks": battle_simulator.EvaluateDecks, "Mutate": battle_simulator.Mutate}
+    
+    # Wraps a function of the simulator so the time spent in it is added to a stage.
+    def Timed(name, stage):
+        function = originals[name]
+        
+        def Wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stages[stage] += time.perf_counter() - start
+        
+        return Wrapper
+    
+    battle_simulator.EvaluateDecks = Timed("EvaluateDecks", "evaluation")
+    battle_simulator.Mutate = Timed("Mutate", "mutation")
+    try:
+        start = time.perf_counter()
+        battle_simulator.Generations(generations, None, seed)
+        elapsed = time.perf_counter() - start
+    finally:
+        for (name, function) in originals.items():
+            setattr(battle_simulator, name, function)
+    
+    stages["other"] = max(0.0, elapsed - stages["evaluation"] - stages["mutation"])
+    
+    return {
+        "generations": generations,
+        "population": pow(2, generations),
+        "seconds": elapsed,
+        "stages": stages
+        }
+
+# The benchmarks in the order they are run, with the sizes of a full run and of a --quick run.
+BENCHMARKS = {
+    "move_selection": (BenchmarkMoveSelection, {"samples": 100000}, {"samples": 10000}),
+    "battles": (BenchmarkBattles, {"games": 2000}, {"games": 200}),
+    "evaluation": (BenchmarkEvaluation, {"evaluations": 200}, {"evaluations": 20}),
+    "deck_generation": (BenchmarkDeckGeneration, {"decks": 20000}, {"decks": 2000}),
+    "mutation": (BenchmarkMutation, {"mutations": 20}, {"mutations": 3}),
+    "generations": (BenchmarkGenerations, {"generations": 4}, {"generations": 2})
+    }
+
+# Runs one benchmark in this process, adding the peak memory traced while it ran (when trace_memory is on) and the process's
+# peak memory so far. The process peak includes every benchmark run before this one, RunIsolated() gives each its own.
+def RunBenchmark(name, seed = 0, quick = False, trace_memory = False):
+    function, sizes, quick_sizes = BENCHMARKS[name]
+    
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        result = function(seed = seed, **(quick_sizes if quick else sizes))
+        if trace_memory:
+            result["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result["process_max_rss_bytes"] = peak if sys.platform == "darwin" else peak * 1024
+    
+    return result
+
+# Runs one benchmark in a new Python process, so its peak memory (max_rss_bytes) is its own and can be compared between commits.
+def RunIsolated(name, seed = 0, quick = False, trace_memory = False):
+    handle, path = tempfile.mkstemp(suffix = ".json")
+    os.close(handle)
+    command = [sys.executable, os.path.abspath(__file__), name, "--in-process", "--seed", str(seed), "--output", path]
+    command += ["--quick"] * quick + ["--memory"] * trace_memory
+    try:
+        subprocess.run(command, check = True, stdout = subprocess.DEVNULL)
+        with open(path) as f:
+            result = json.load(f)["benchmarks"][name]
+    finally:
+        os.remove(path)
+    
+    if "process_max_rss_bytes" in result:
+        result["max_rss_bytes"] = result.pop("process_max_rss_bytes")
+    
+    return result
+
+# The commit the benchmarks were run at, if this is a git checkout.
+def GitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Runs the benchmarks and returns a dictionary that can be put into json files.
+# With isolate set every benchmark runs in its own process, otherwise they all run in this one.
+def RunBenchmarks(names = None, seed = 0, quick = False, trace_memory = False, isolate = True):
+    report = {
+        "commit": GitCommit(),
+        "python": platform.python_version(),
+        "seed": seed,
+        "quick": quick,
+        "benchmarks": {}
+        }
+    
+    start = time.perf_counter()
+    for name in names or BENCHMARKS:
+        run = RunIsolated if isolate else RunBenchmark
+        report["benchmarks"][name] = run(name, seed, quick, trace_memory)
+    report["seconds"] = time.perf_counter() - start
+    
+    return report
+
+# Compares the wall time of each benchmark with a report saved before, returning a line for each benchmark they share
+# and whether any of them got slower by more than threshold (a fraction, 0.1 is 10% slower).
+def CompareReports(report, baseline, threshold = 0.1):
+    lines = []
+    regressed = False
+    for (name, result) in report["benchmarks"].items():
+        old = baseline.get("benchmarks", {}).get(name)
+        if old is None or not old.get("seconds"):
+            continue
+        
+        change = result["seconds"] / old["seconds"] - 1
+        slower = change > threshold
+        regressed = regressed or slower
+        lines.append("{:<16} {:8.3f}s -> {:8.3f}s {:+7.1%}{}".format(name, old["seconds"], result["seconds"], change,
+                                                                     "  REGRESSION" if slower else ""))
+    
+    return lines, regressed
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Measures how fast parts of the simulator are.")
+    parser.add_argument("benchmarks", nargs = "*", help = "benchmarks to run, all of them if none are given: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--quick", action = "store_true", help = "smaller sizes, for a quick check")
+    parser.add_argument("--memory", action = "store_true", help = "trace peak Python memory of each benchmark (makes them slower)")
+    parser.add_argument("--in-process", action = "store_true",
+                        help = "run every benchmark in this process, its peak memory then only covers the process as a whole")
+    parser.add_argument("--output", default = None, help = "json file to save the results to")
+    parser.add_argument("--compare", default = None, help = "json file of earlier results to compare with")
+    parser.add_argument("--threshold", type = float, default = 0.1, help = "slowdown counted as a regression, 0.1 is 10%%")
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark {!r}, expected one of {}".format(name, ", ".join(BENCHMARKS)))
+    
+    report = RunBenchmarks(args.benchmarks, args.seed, args.quick, args.memory, not args.in_process)
+    
+    for (name, result) in report["benchmarks"].items():
+        details = ", ".join("{} {}".format(key, round(value, 4) if isinstance(value, float) else value)
+                            for (key, value) in result.items() if key != "stages")
+        print("{}: {}".format(name, details))
+        if "stages" in result:
+            print("    stages: " + ", ".join("{} {:.3f}s".format(stage, seconds) for (stage, seconds) in result["stages"].items()))
+    
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent = 2)
+            f.write("\n")
+    
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines, regressed = CompareReports(report, baseline, args.threshold)
+        print("Compared with {}:".format(baseline.get("commit") or args.compare))
+        print("\n".join(lines))
+        if regressed:
+            return 1
+    
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+# This program works out exactly, instead of by playing games, how a single deck is likely to draw and power up.
+# The chances come from counting (hypergeometric probabilities for draws, dynamic programming over energy attachments)
+# and follow the rules of battle_simulator.py: the opening hand of 5 is redrawn until it holds a basic Pokemon,
+# a card is drawn every turn, and one random energy from the energy zone is attached every turn except the very first turn of the game.
+# It only needs the card data so battle_simulator.py can use it to throw away hopeless decks before they play any games.
+
+import argparse
+import collections
+import functools
+import math
+import random
+
+from matchup_cache import DeckSignature
+
+OPENING_HAND = 5
+TURNS = 10 # own turns the per-turn chances are worked out for
+
+# The chance that the first 5 cards of a shuffled deck hold no basic Pokemon, so the hand has to be redrawn.
+def MulliganProbability(deck_size, basic_count):
+    return math.comb(deck_size - basic_count, OPENING_HAND) / math.comb(deck_size, OPENING_HAND)
+
+# The chance that at least one of copies copies of a non-basic card is among the first seen cards of the deck,
+# given that the opening hand holds a basic Pokemon (as it always does after redrawing).
+# If none of the copies are in the first seen cards, those cards are an even draw from the rest of the deck,
+# so the chance of a basic in the opening hand can be worked out for that case on its own.
+def DrawnProbability(deck_size, basic_count, copies, seen):
+    seen = min(seen, deck_size)
+    missing = math.comb(deck_size - copies, seen) / math.comb(deck_size, seen)
+    basic_without = 1 - MulliganProbability(deck_size - copies, basic_count)
+    basic = 1 - MulliganProbability(deck_size, basic_count)
+    
+    return 1 - missing * basic_without / basic
+
+# The chance that a cost can be paid after each number of attachments from 0 to limit, when every attachment is a random
+# energy from the zone. cost is a tuple of (energy type, amount) pairs where "Normal" can be paid by any energy,
+# zone is a tuple of energy type names. The counts of each type are capped at what the cost could use, so there are few states.
+@functools.lru_cache(maxsize = None)
+def AttachCurve(cost, zone, limit = 2 * TURNS):
+    required = dict(cost)
+    normal = required.pop("Normal", 0)
+    if not zone or any(energy_type not in zone for energy_type in required):
+        return (0.0,) * (limit + 1)
+    
+    types = sorted(set(zone))
+    chances = [zone.count(energy_type) / len(zone) for energy_type in types]
+    caps = [required.get(energy_type, 0) + normal for energy_type in types]
+    
+    def Payable(counts):
+        spare = 0
+        for (energy_type, count) in zip(types, counts):
+            need = required.get(energy_type, 0)
+            if count < need:
+                return False
+            spare += count - need
+        return spare >= normal
+    
+    # States that still can't pay with their chance, the chance that was paid by each attachment is taken out as it happens.
+    states = {tuple(0 for energy_type in types): 1.0}
+    curve = []
+    paid = 0.0
+    for attachment in range(limit + 1):
+        unpaid = {}
+        for (counts, chance) in states.items():
+            if Payable(counts):
+                paid += chance
+            else:
+                unpaid[counts] = chance
+        curve.append(min(paid, 1.0))
+        
+        states = collections.defaultdict(float)
+        for (counts, chance) in unpaid.items():
+            for (i, type_chance) in enumerate(chances):
+                new_counts = list(counts)
+                new_counts[i] = min(new_counts[i] + 1, caps[i])
+                states[tuple(new_counts)] += chance * type_chance
+    
+    return tuple(curve)
+
+# The chance a cost has been paid by each of a player's own turns 1 to turns, from an AttachCurve().
+# Whoever goes first (half the games) gets no energy on their first turn, so on own turn t they have had t - 1 attachments.
+def TurnCurve(curve, turns = TURNS):
+    return tuple(0.5 * curve[turn - 1] + 0.5 * curve[min(turn, len(curve) - 1)] for turn in range(1, turns + 1))
+
+# The expected own turn a cost is paid on, None if it can never be paid.
+# The small chance it is still unpaid at the end of the curve is counted as paid on the last turn.
+def ExpectedTurn(curve):
+    if curve[-1] == 0:
+        return None
+    
+    turn_curve = TurnCurve(curve, len(curve))
+    expected = 1.0
+    for chance in turn_curve[:-1]:
+        expected += 1 - chance
+    
+    return expected
+
+# Exact analytics of decks, cached by deck signature. by_id maps card ids to the card data of the card pool json,
+# basic_ids are the cards that can be played into the active spot (CardCatalog.basic_ids, which leaves out the fossil trainers).
+class DeckAnalytics:
+    def __init__(self, by_id, basic_ids, capacity = 100000):
+        self.by_id = by_id
+        self.basic_ids = basic_ids
+        self.capacity = capacity
+        self.reports = collections.OrderedDict()
+    
+    # The cheapest damaging move of a card as a cost tuple for AttachCurve(), None if the card has no damaging move.
+    def CheapestCost(self, card_id):
+        costs = [move["energyCost"] for move in self.by_id[card_id].get("moves") or [] if move.get("damage", 0) > 0]
+        if not costs:
+            return None
+        
+        return tuple(sorted(min(costs, key = lambda cost: sum(cost.values())).items()))
+    
+    # Pokemon whose whole evolution line down to a basic Pokemon is in the deck, the ones that can reach the active spot.
+    def Reachable(self, deck_ids):
+        present = set(deck_ids)
+        reachable = set()
+        for card_id in present:
+            line = card_id
+            seen = set() # the card pool has cards that evolve from themselves
+            while line in present and line not in seen and self.by_id[line].get("evolvesFrom"):
+                seen.add(line)
+                line = self.by_id[line]["evolvesFrom"]
+            if line in present and line in self.basic_ids:
+                reachable.add(card_id)
+        
+        return reachable
+    
+    # A dictionary of the deck's analytics:
+    # mulligan - the chance the first opening hand has no basic Pokemon and is redrawn,
+    # evolution_by_turn - for each evolution card whose earlier stage is in the deck, the chance of having drawn it by own turns 1 to TURNS,
+    # attack_turn - for each Pokemon that can reach the active spot, the expected own turn its cheapest damaging move can be paid for
+    # (None if the energy zone can never pay for it),
+    # first_attack_turn - the soonest of those, can_attack - whether any of them can ever attack.
+    def Analyze(self, deck_ids, energy_zone):
+        key = DeckSignature(deck_ids, energy_zone)
+        report = self.reports.get(key)
+        if report is not None:
+            self.reports.move_to_end(key)
+            return report
+        
+        deck_size = len(deck_ids)
+        copies = collections.Counter(deck_ids)
+        basic_count = sum(amount for (card_id, amount) in copies.items() if card_id in self.basic_ids)
+        reachable = self.Reachable(deck_ids)
+        zone = tuple(sorted(energy_zone))
+        
+        evolution_by_turn = {}
+        for card_id in sorted(reachable):
+            if self.by_id[card_id].get("evolvesFrom") and basic_count:
+                evolution_by_turn[card_id] = [DrawnProbability(deck_size, basic_count, copies[card_id], OPENING_HAND + turn)
+                                              for turn in range(1, TURNS + 1)]
+        
+        attack_turn = {}
+        for card_id in sorted(reachable):
+            cost = self.CheapestCost(card_id)
+            if cost is not None:
+                attack_turn[card_id] = ExpectedTurn(AttachCurve(cost, zone))
+        turns = [turn for turn in attack_turn.values() if turn is not None]
+        
+        report = {
+            "mulligan": MulliganProbability(deck_size, basic_count) if deck_size >= OPENING_HAND else 1.0,
+            "evolution_by_turn": evolution_by_turn,
+            "attack_turn": attack_turn,
+            "first_attack_turn": min(turns) if turns else None,
+            "can_attack": bool(turns)
+            }
+        
+        self.reports[key] = report
+        if len(self.reports) > self.capacity:
+            self.reports.popitem(last = False)
+        
+        return report
+    
+    # Whether a deck can't be worth playing: none of the Pokemon that can reach the active spot can ever pay for a damaging move
+    # with its energy zone, so it can never knock anything out.
+    def Hopeless(self, deck_ids, energy_zone):
+        return not self.Analyze(deck_ids, energy_zone)["can_attack"]
+
+# A deck with 6 fossil trainers (stage 0 cards that aren't basic Pokemon), 2 basic Pokemon and evolutions whose earlier stages are fossils.
+FOSSIL_DECK = ["216", "216", "217", "217", "218", "218", "001", "001", "002", "002",
+               "081", "081", "158", "158", "210", "210", "003", "003", "006", "006"]
+
+# Checks the analytics of a deck against the simulator's own draws: the mulligan chance against shuffled opening hands
+# with basics counted the way battle_simulator.py counts them, and the chance of having drawn each evolution by own turn 1
+# against hands dealt by Player.StartDeckDraw(). Returns a list of (what, exact chance, sampled chance, within 4 standard errors).
+def CheckDraws(deck_ids, energy_zone, draws = 20000, seed = 0):
+    import battle_simulator # battle_simulator.py imports this module
+    
+    catalog = battle_simulator.GetCatalog()
+    report = catalog.analytics.Analyze(deck_ids, energy_zone)
+    rng = random.Random(seed)
+    indices = catalog.Indices(deck_ids)
+    
+    sampled = {"mulligan": 0}
+    sampled.update({card_id: 0 for card_id in report["evolution_by_turn"]})
+    for i in range(draws):
+        if not any(catalog.is_basic[card] for card in rng.sample(indices, OPENING_HAND)):
+            sampled["mulligan"] += 1
+        
+        player = battle_simulator.Player(deck_ids, energy_zone, rng)
+        player.StartDeckDraw()
+        seen = set(catalog.Ids(player.deck[:OPENING_HAND + 1])) # the opening hand and the card drawn on own turn 1
+        for card_id in report["evolution_by_turn"]:
+            sampled[card_id] += card_id in seen
+    
+    exact = {"mulligan": report["mulligan"]}
+    exact.update({card_id: chances[0] for (card_id, chances) in report["evolution_by_turn"].items()})
+    checks = []
+    for (what, chance) in exact.items():
+        rate = sampled[what] / draws
+        error = math.sqrt(max(chance * (1 - chance), 1e-12) / draws)
+        checks.append((what, chance, rate, abs(rate - chance) <= 4 * error))
+    
+    return checks
+
+def main(argv = None):
+    import battle_simulator
+    
+    parser = argparse.ArgumentParser(description = "Checks the exact deck analytics against the simulator's own draws.")
+    parser.add_argument("--card-pool", default = battle_simulator.DEFAULT_CARD_POOL_PATH, help = "card pool json to load")
+    parser.add_argument("--draws", type = int, default = 20000, help = "opening hands to sample")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args(argv)
+    
+    battle_simulator.SetCatalog(battle_simulator.LoadCardCatalog(args.card_pool))
+    analytics = battle_simulator.GetCatalog().analytics
+    passed = True
+    
+    # The fossils aren't basic Pokemon, so Omanyte, Kabuto and Aerodactyl can never reach the active spot.
+    unreachable = {"081", "158", "210"} & analytics.Reachable(FOSSIL_DECK)
+    print("Fossil evolutions that can't be played: {}".format("ok" if not unreachable else "reachable " + ", ".join(sorted(unreachable))))
+    passed &= not unreachable
+    
+    for (what, chance, rate, ok) in CheckDraws(FOSSIL_DECK, ["Grass"], args.draws, args.seed):
+        print("{}: exact {:.4f}, sampled {:.4f} {}".format(what, chance, rate, "ok" if ok else "MISMATCH"))
+        passed &= ok
+    
+    raise SystemExit(0 if passed else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+# This program saves battles as training data for the neural network, in fixed-width binary records instead of json dicts.
+# GameRecordWriter is a BattleLogger that buffers one record per turn and one per game and writes them out in chunks of
+# chunk_size records, so memory stays the same however many games are played. Each chunk is a .npy file (or a compressed
+# .npz file) and GameRecordReader memory-maps the chunks back one at a time. Needs NumPy.
+
+import glob
+import json
+import os
+import re
+
+import numpy as np
+
+import battle_simulator
+from battle_simulator import ENERGY_TYPES, LOG_FULL, LOG_OUTCOME, SeededBattle
+
+# The codes used for the turn result, the end of game reason and the players in the records.
+RESULTS = ("ongoing", "continued after promotion", "win/lose", "draw")
+REASONS = ("knockout", "points", "draw", "no active")
+NO_PLAYER = -1 # the winner of a draw, and a missing active Pokemon
+DECK_SIZE = 20
+
+# One record per turn, the players (index 0 and 1) are in the order they were passed to Battle().
+TURN_DTYPE = np.dtype([
+    ("game", np.uint64),
+    ("turn", np.uint16),
+    ("offender", np.int8),
+    ("result", np.uint8),
+    ("winner", np.int8),
+    ("active", np.int16, (2,)), # catalog index of each active Pokemon
+    ("hp", np.int16, (2,)),
+    ("energy", np.uint8, (2, len(ENERGY_TYPES))), # energy attached to each active Pokemon
+    ("points", np.uint8, (2,)),
+    ("hand", np.uint8, (2,)), # cards in hand
+    ("deck_left", np.uint8, (2,)) # cards not drawn yet
+    ])
+
+# One record per game.
+GAME_DTYPE = np.dtype([
+    ("game", np.uint64),
+    ("winner", np.int8),
+    ("turns", np.uint16),
+    ("points", np.uint8, (2,)),
+    ("reason", np.uint8),
+    ("deck", np.int16, (2, DECK_SIZE)), # catalog indices, padded with NO_PLAYER
+    ("energy_zone", np.int8, (2, 3)) # ENERGY_TYPES indices, padded with NO_PLAYER
+    ])
+
+# The number after the last chunk file of a kind and shard in a directory, 0 if there are none.
+# The whole name is matched, so the chunks of shard "a" are told apart from those of shard "a-b".
+def NextChunk(directory, kind, shard):
+    pattern = re.compile(r"^{}-{}-(\d{{6}})\.np[yz]$".format(re.escape(kind), re.escape(shard)))
+    matches = [pattern.match(name) for name in os.listdir(directory)]
+    numbers = [int(match.group(1)) for match in matches if match]
+    
+    return max(numbers) + 1 if numbers else 0
+
+# Records of one kind ("turns" or "games") waiting to be written, written as a chunk file once chunk_size of them are held.
+# Chunks are numbered after the ones already in the directory, so records written earlier are never overwritten.
+class ChunkBuffer:
+    def __init__(self, directory, kind, dtype, shard, chunk_size, compress):
+        self.directory = directory
+        self.kind = kind
+        self.shard = shard
+        self.compress = compress
+        self.records = np.zeros(chunk_size, dtype = dtype)
+        self.size = 0
+        self.chunks = NextChunk(directory, kind, shard)
+        self.written = 0
+    
+    # The next free record, to be filled in by the caller.
+    def Next(self):
+        if self.size == len(self.records):
+            self.Flush()
+        record = self.records[self.size]
+        self.size += 1
+        
+        return record
+    
+    # Writes the held records as the next chunk file.
+    def Flush(self):
+        if self.size == 0:
+            return
+        
+        path = os.path.join(self.directory, "{}-{}-{:06d}".format(self.kind, self.shard, self.chunks))
+        if self.compress:
+            np.savez_compressed(path + ".npz", records = self.records[:self.size])
+        else:
+            np.save(path + ".npy", self.records[:self.size])
+        self.chunks += 1
+        self.written += self.size
+        self.size = 0
+        
+        return
+
+# A BattleLogger that streams the records of every game it is passed to into a directory of chunk files.
+# With level LOG_OUTCOME only game records are written, with LOG_SUMMARY or LOG_FULL turn records are written too.
+# Several writers can share a directory as long as each has its own shard name, like one per worker process.
+# A writer opened on a directory that already has records adds to them: its chunks are numbered after the existing ones
+# and its games after the manifest's next_game, unless first_game is given.
+class GameRecordWriter(battle_simulator.BattleLogger):
+    def __init__(self, directory, level = LOG_FULL, chunk_size = 65536, compress = False, shard = "0", first_game = None):
+        super().__init__(level)
+        os.makedirs(directory, exist_ok = True)
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.turns = ChunkBuffer(directory, "turns", TURN_DTYPE, shard, chunk_size, compress)
+        self.games = ChunkBuffer(directory, "games", GAME_DTYPE, shard, chunk_size, compress)
+        self.game = None
+        
+        # The card ids the catalog indices stand for, so the records can be read with a different catalog,
+        # and the game number after the last game written.
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest["card_ids"] != list(battle_simulator.GetCatalog().ids):
+                raise ValueError("{} holds records of a different card pool".format(directory))
+        else:
+            manifest = {"card_ids": list(battle_simulator.GetCatalog().ids), "energy_types": list(ENERGY_TYPES),
+                        "results": list(RESULTS), "reasons": list(REASONS), "next_game": 0}
+            self.WriteManifest(manifest)
+        # Writers sharing a directory at the same time should be given ranges of game numbers that don't overlap.
+        self.next_game = first_game if first_game is not None else manifest.get("next_game", 0)
+    
+    # Writes the manifest next to the old one and then swaps it in.
+    def WriteManifest(self, manifest):
+        temporary_path = self.manifest_path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(temporary_path, self.manifest_path)
+        
+        return
+    
+    def BeginGame(self, player1, player2):
+        super().BeginGame(player1, player2)
+        self.game = self.next_game
+        self.next_game += 1
+        
+        return
+    
+    def Record(self, offender, defender, turn, result, winner = None):
+        if self.level < battle_simulator.LOG_SUMMARY:
+            return
+        
+        record = self.turns.Next()
+        record["game"] = self.game
+        record["turn"] = turn
+        record["offender"] = 0 if offender is self.players[0] else 1
+        record["result"] = RESULTS.index(result)
+        record["winner"] = ("player1", "player2").index(winner) if winner else NO_PLAYER
+        for (side, player) in enumerate(self.players):
+            pokemon = player.active_pokemon
+            record["active"][side] = pokemon.card if pokemon else NO_PLAYER
+            record["hp"][side] = max(pokemon.current_hp, 0) if pokemon else 0
+            record["energy"][side] = pokemon.attached_energy if pokemon else 0
+            record["points"][side] = player.points
+            record["hand"][side] = len(player.hand)
+            record["deck_left"][side] = len(player.deck) - player.deck_cursor
+        
+        return
+    
+    def EndGame(self, outcome):
+        if self.level < LOG_OUTCOME:
+            return
+        
+        record = self.games.Next()
+        record["game"] = self.game
+        record["winner"] = ("player1", "player2").index(outcome.winner) if outcome.winner else NO_PLAYER
+        record["turns"] = outcome.turns
+        record["points"] = outcome.points
+        record["reason"] = REASONS.index(outcome.reason)
+        record["deck"] = NO_PLAYER
+        record["energy_zone"] = NO_PLAYER
+        for (side, player) in enumerate(self.players):
+            if len(player.deck) > DECK_SIZE:
+                raise ValueError("Decks of more than {} cards can't be recorded".format(DECK_SIZE))
+            record["deck"][side, :len(player.deck)] = player.deck
+            record["energy_zone"][side, :len(player.energy_zone)] = player.energy_zone
+        
+        return
+    
+    # Writes every record still held, and the next game number to the manifest.
+    def Flush(self):
+        self.turns.Flush()
+        self.games.Flush()
+        
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        if self.next_game > manifest.get("next_game", 0):
+            manifest["next_game"] = self.next_game
+            self.WriteManifest(manifest)
+        
+        return
+    
+    def Close(self):
+        self.Flush()
+        
+        return
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.Close()
+
+# Plays PlayGame() jobs in this process with their records streamed to writer, returning the winner of each.
+def RecordGames(jobs, writer, cardPool = None):
+    winners = []
+    for (deck, energy_zone, opponent_deck, opponent_energy_zone, seed) in jobs:
+        winners.append(SeededBattle(deck, energy_zone, opponent_deck, opponent_energy_zone, seed, writer, cardPool).winner)
+    
+    return winners
+
+# Reads a directory written by GameRecordWriter. The chunks are memory-mapped (or, when compressed, loaded) one at a time,
+# so any number of records can be gone through with the memory of a single chunk.
+class GameRecordReader:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.card_ids = self.manifest["card_ids"]
+    
+    # The chunk files of a kind, in the order they were written.
+    def Paths(self, kind):
+        return sorted(glob.glob(os.path.join(self.directory, kind + "-*.np[yz]")))
+    
+    # Yields the records of a kind one chunk at a time as read-only arrays.
+    def Chunks(self, kind):
+        for path in self.Paths(kind):
+            if path.endswith(".npz"):
+                with np.load(path) as archive:
+                    yield archive["records"]
+            else:
+                yield np.load(path, mmap_mode = "r")
+    
+    def TurnChunks(self):
+        return self.Chunks("turns")
+    
+    def GameChunks(self):
+        return self.Chunks("games")
+    
+    # Yields every turn record one at a time.
+    def Turns(self):
+        for chunk in self.TurnChunks():
+            yield from chunk
+    
+    # Yields every game record one at a time.
+    def Games(self):
+        for chunk in self.GameChunks():
+            yield from chunk
+    
+    # How many records of a kind there are, uncompressed chunks only have their headers read.
+    def Count(self, kind):
+        return sum(len(chunk) for chunk in self.Chunks(kind))
+    
+    # The card ids of an array of catalog indices from the records.
+    def CardIds(self, indices):
+        return [self.card_ids[index] if index >= 0 else None for index in np.asarray(indices).ravel().tolist()]
@@ -0,0 +1,148 @@
+# This program evolves decks on several islands at once, each island is a population of decks evolving in its own process.
+# Every interval generations the islands send copies of their best decks to the next island (in a ring),
+# which keeps the islands from all converging on the same deck while still spreading good decks around.
+
+import argparse
+import concurrent.futures
+import json
+import random
+
+import battle_simulator
+from battle_simulator import DeriveSeed, EvaluateDecks, GenerateRandomDecks, GetCatalog, InitWorker, Mutate, Player
+
+# One generation of an island: every deck is evaluated against random decks, the better half survives
+# and the worse half is replaced by mutants of the survivors made with Mutate().
+def IslandGeneration(population, cardPool, games, rng):
+    winrates = EvaluateDecks(population, cardPool, games, None, rng.getrandbits(64))
+    order = sorted(range(len(population)), key = lambda i: -winrates[i])
+    keep = max(1, len(population) // 2)
+    
+    survivors = [population[i] for i in order[:keep]]
+    children = []
+    for k in range(len(population) - keep):
+        parent = order[k % keep]
+        children.append(Mutate(population[parent], winrates[parent], cardPool, rng))
+    
+    return survivors + children
+
+# Runs generations generations of an island and evaluates it once more, returning the decks sorted from best to worst
+# with their win rates. Decks are sent between processes as (deck, energy_zone) lists of catalog indices.
+def EvolveIsland(population, generations, games, seed):
+    rng = random.Random(seed)
+    cardPool = GetCatalog().cards
+    decks = [Player(deck, energy_zone) for (deck, energy_zone) in population]
+    
+    for i in range(generations):
+        decks = IslandGeneration(decks, cardPool, games, rng)
+    
+    winrates = EvaluateDecks(decks, cardPool, games, None, rng.getrandbits(64))
+    order = sorted(range(len(decks)), key = lambda i: -winrates[i])
+    
+    return [(decks[i].deck, decks[i].energy_zone) for i in order], [winrates[i] for i in order]
+
+# Copies the best migrants decks of every island over the worst decks of the next island, islands are sorted best first.
+def Migrate(islands, migrants):
+    if len(islands) < 2 or migrants <= 0:
+        return islands
+    
+    outgoing = [island[:migrants] for island in islands]
+    for (i, island) in enumerate(islands):
+        incoming = outgoing[i - 1]
+        islands[i] = island[:len(island) - len(incoming)] + incoming
+    
+    return islands
+
+# The result of IslandEvolution().
+class IslandResult:
+    def __init__(self, best, winrate, champions, history):
+        self.best = best # the best deck found, as a Player
+        self.winrate = winrate # its win rate over the final evaluation
+        self.champions = champions # the best deck of each island, as Players
+        self.history = history # the best win rate of each island after every epoch
+    
+    # Dictionary that can be put into json files.
+    def to_dict(self):
+        return {
+            "best": self.best.to_dict(),
+            "winrate": self.winrate,
+            "champions": [{"deck": champion.deck_ids, "energy_zone": champion.energy_names} for champion in self.champions],
+            "history": self.history
+            }
+
+# Evolves islands populations of population decks for epochs epochs of interval generations each, migrating migrants decks
+# between neighbouring islands after every epoch. Each island plays games games per deck evaluation.
+# The islands run in workers processes (one per island by default, 1 runs them one after another in this process).
+# At the end the best deck of every island plays final_games more games and the best of them is returned in an IslandResult.
+# Every island's generations are seeded from seed and their epoch, so the result is the same for any number of workers.
+def IslandEvolution(islands = 4, population = 16, epochs = 5, interval = 2, migrants = 2, games = 10, final_games = 100,
+                    seed = None, workers = None):
+    if seed is None:
+        seed = random.getrandbits(64)
+    rng = random.Random(seed)
+    
+    populations = []
+    for i in range(islands):
+        decks = GenerateRandomDecks(GetCatalog().cards, population, rng)
+        decks = decks if isinstance(decks, list) else [decks]
+        populations.append([(deck.deck, deck.energy_zone) for deck in decks])
+    
+    workers = workers or islands
+    executor = None
+    if workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(min(workers, islands), initializer = InitWorker,
+                                                          initargs = (GetCatalog().cards,))
+    
+    history = []
+    try:
+        for epoch in range(epochs):
+            seeds = [DeriveSeed(seed, "island", i, epoch) for i in range(islands)]
+            if executor is not None:
+                results = list(executor.map(EvolveIsland, populations, [interval] * islands, [games] * islands, seeds))
+            else:
+                results = [EvolveIsland(populations[i], interval, games, seeds[i]) for i in range(islands)]
+            
+            populations = [decks for (decks, winrates) in results]
+            history.append([winrates[0] for (decks, winrates) in results])
+            if epoch < epochs - 1:
+                populations = Migrate(populations, migrants)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    
+    champions = [Player(*decks[0]) for decks in populations]
+    winrates = EvaluateDecks(champions, GetCatalog().cards, final_games, None, DeriveSeed(seed, "final"))
+    best = max(range(islands), key = lambda i: winrates[i])
+    
+    return IslandResult(champions[best], winrates[best], champions, history)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Evolves decks on islands in parallel processes with migration between them.")
+    parser.add_argument("--card-pool", default = battle_simulator.DEFAULT_CARD_POOL_PATH, help = "card pool json to load")
+    parser.add_argument("--islands", type = int, default = 4)
+    parser.add_argument("--population", type = int, default = 16, help = "decks on each island")
+    parser.add_argument("--epochs", type = int, default = 5, help = "migrations plus one")
+    parser.add_argument("--interval", type = int, default = 2, help = "generations between migrations")
+    parser.add_argument("--migrants", type = int, default = 2, help = "decks each island sends to the next one")
+    parser.add_argument("--games", type = int, default = 10, help = "games per deck evaluation")
+    parser.add_argument("--final-games", type = int, default = 100, help = "games the island champions play at the end")
+    parser.add_argument("--seed", type = int, default = None, help = "makes the run reproducible")
+    parser.add_argument("--workers", type = int, default = 0, help = "processes to run islands in, 0 for one per island")
+    parser.add_argument("--output", default = "top_decks.json", help = "json file the top deck is appended to")
+    args = parser.parse_args(argv)
+    
+    battle_simulator.SetCatalog(battle_simulator.LoadCardCatalog(args.card_pool))
+    result = IslandEvolution(args.islands, args.population, args.epochs, args.interval, args.migrants, args.games,
+                             args.final_games, args.seed, args.workers or None)
+    
+    for (epoch, winrates) in enumerate(result.history):
+        print("Epoch {}: best win rates {}".format(epoch + 1, ", ".join("{:.0f}%".format(winrate) for winrate in winrates)))
+    print("Top deck ({:.1f}%):".format(result.winrate), result.best.deck_ids, result.best.energy_names)
+    
+    with open(args.output, "a") as f:
+        json.dump(result.best.to_dict(), f, indent = 2)
+        f.write("\n")
+    
+    return
+
+if __name__ == "__main__":
+    main()
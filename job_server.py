@@ -0,0 +1,383 @@
+# This program runs the simulator as a local job service, so other programs can submit deck evaluations, tournaments and
+# generations runs over HTTP (on localhost or a Unix socket) and poll or stream their progress.
+# Evaluations that arrive close together are batched: their games are mixed into shared chunks for the worker processes,
+# so many small evaluations keep every worker busy. Tournaments and generations runs each get a thread that plays
+# its games on the same workers. Only the standard library is used.
+#
+#   POST /jobs              submit a job, the body is json with a "kind" of "evaluate", "tournament" or "generations"
+#   GET  /jobs              every job's status
+#   GET  /jobs/<id>         one job's status, progress and result
+#   GET  /jobs/<id>/events  a stream of json lines, one every time the job changes, until it is finished
+#   GET  /health            whether the server is up
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import random
+
+import battle_simulator
+from battle_simulator import EvaluationJobs, EvaluationPool, Player, PlayChunk, WilsonInterval
+from selection import BRACKET, SELECTIONS
+from tournament import FORMATS, ROUND_ROBIN
+
+MAX_BODY = 1 << 20 # bytes a request body may have
+
+# Something wrong with a request, answered with its status code.
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# A submitted job, its progress is (done, total) in games for evaluations, rounds for tournaments and generations for runs.
+class Job:
+    def __init__(self, job_id, kind, request):
+        self.id = job_id
+        self.kind = kind
+        self.request = request
+        self.status = "queued" # then "running" and "done" or "failed"
+        self.progress = (0, 0)
+        self.result = None
+        self.error = None
+        self.changed = asyncio.Event() # set and replaced every time the job changes
+    
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+    
+    def Update(self, **fields):
+        for (name, value) in fields.items():
+            setattr(self, name, value)
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+        
+        return
+    
+    # Dictionary that can be put into json files.
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": list(self.progress),
+            "result": self.result,
+            "error": self.error
+            }
+
+# A whole number field of a request between low and high, default when it is missing (or null).
+def RequestInteger(request, name, default, low, high):
+    value = request.get(name)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+        raise RequestError(400, "{} must be a whole number between {} and {}".format(name, low, high))
+    
+    return value
+
+# A seed field of a request, a random one when it is missing.
+def RequestSeed(request):
+    seed = request.get("seed")
+    if seed is None:
+        return random.getrandbits(64)
+    if isinstance(seed, bool) or not isinstance(seed, int):
+        raise RequestError(400, "seed must be a whole number")
+    
+    return seed
+
+# A field of a request that has to be one of choices, default when it is missing.
+def RequestChoice(request, name, default, choices):
+    value = request.get(name, default)
+    if value not in choices:
+        raise RequestError(400, "{} must be one of {}".format(name, ", ".join("null" if choice is None else str(choice) for choice in choices)))
+    
+    return value
+
+# Turns a deck and energy zone from a request into a Player, checking that they follow the deck rules.
+def RequestDeck(deck, energy_zone):
+    catalog = battle_simulator.GetCatalog()
+    if not isinstance(deck, list) or not isinstance(energy_zone, list):
+        raise RequestError(400, "a deck and its energy zone must be lists of card ids and energy types")
+    if not all(isinstance(card_id, str) for card_id in deck) or not all(isinstance(energy_type, str) for energy_type in energy_zone):
+        raise RequestError(400, "card ids and energy types must be strings")
+    unknown = [card_id for card_id in deck if card_id not in catalog]
+    if unknown:
+        raise RequestError(400, "unknown card ids: {}".format(", ".join(map(str, unknown))))
+    if any(energy_type not in battle_simulator.ENERGY_INDEX for energy_type in energy_zone):
+        raise RequestError(400, "unknown energy types in {}".format(energy_zone))
+    
+    player = Player(deck, energy_zone)
+    if not player.DeckValidation():
+        raise RequestError(400, "the deck breaks the deck rules")
+    
+    return player
+
+# The job service. Evaluation games are played on an EvaluationPool's workers in chunks of up to chunk_size games,
+# evaluations submitted within batch_delay seconds of each other share chunks.
+class JobServer:
+    def __init__(self, workers = None, batch_delay = 0.05, chunk_size = 50, long_jobs = 2):
+        self.pool = EvaluationPool(workers)
+        self.batch_delay = batch_delay
+        self.chunk_size = chunk_size
+        self.threads = concurrent.futures.ThreadPoolExecutor(long_jobs) # tournaments and generations runs
+        self.jobs = {}
+        self.next_id = 1
+        self.pending = [] # evaluations waiting for the next batch
+        self.flush = None
+        self.tasks = set()
+    
+    # Checks every field of a request and queues its job, the job is given the checked values.
+    def Submit(self, request):
+        if not isinstance(request, dict):
+            raise RequestError(400, "the request must be a json object")
+        kind = request.get("kind")
+        if kind == "evaluate":
+            deck = RequestDeck(request.get("deck"), request.get("energy_zone"))
+            opponent = None
+            if request.get("opponent_deck") is not None:
+                opponent = RequestDeck(request["opponent_deck"], request.get("opponent_energy_zone"))
+            work = (deck, opponent, RequestInteger(request, "games", 10, 1, 100000), RequestSeed(request))
+        elif kind == "tournament":
+            entries = request.get("decks")
+            if not isinstance(entries, list) or len(entries) < 2 or not all(isinstance(entry, dict) for entry in entries):
+                raise RequestError(400, "decks must be a list of at least 2 objects with a deck and an energy_zone")
+            work = {
+                "decks": [RequestDeck(entry.get("deck"), entry.get("energy_zone")) for entry in entries],
+                "games": RequestInteger(request, "games", 10, 1, 10000),
+                "format": RequestChoice(request, "format", ROUND_ROBIN, FORMATS),
+                "rounds": RequestInteger(request, "rounds", None, 1, 64),
+                "seed": RequestSeed(request)
+                }
+        elif kind == "generations":
+            generations = RequestInteger(request, "generations", 5, 1, 12)
+            population = RequestInteger(request, "population", None, 2, 1024)
+            selection = RequestChoice(request, "selection", BRACKET, SELECTIONS)
+            if selection == BRACKET and (request.get("population") is not None or request.get("elites") is not None):
+                raise RequestError(400, "population and elites need the elitist selection")
+            paired = request.get("paired", False)
+            if not isinstance(paired, bool):
+                raise RequestError(400, "paired must be true or false")
+            work = {
+                "generations": generations,
+                "seed": RequestSeed(request),
+                "tournament_format": RequestChoice(request, "tournament_format", None, (None,) + FORMATS),
+                "paired": paired,
+                "selection": selection,
+                "population": population,
+                "elites": RequestInteger(request, "elites", None, 1, population or pow(2, generations))
+                }
+        else:
+            raise RequestError(400, "kind must be evaluate, tournament or generations")
+        
+        job = Job(str(self.next_id), kind, request)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        
+        if kind == "evaluate":
+            self.pending.append((job, work))
+            if self.flush is None:
+                self.flush = asyncio.get_running_loop().call_later(self.batch_delay, self.StartBatch)
+        else:
+            self.Start(self.RunLongJob(job, work))
+        
+        return job
+    
+    def Start(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        
+        return task
+    
+    def StartBatch(self):
+        batch, self.pending, self.flush = self.pending, [], None
+        self.Start(self.RunBatch(batch))
+        
+        return
+    
+    # Plays a batch of evaluations, their games are mixed into chunks so small evaluations share workers.
+    async def RunBatch(self, batch):
+        loop = asyncio.get_running_loop()
+        games = []
+        counts = {}
+        for (job, (deck, opponent, n, seed)) in batch:
+            games.extend((job, game) for game in EvaluationJobs(deck, opponent, seed, 0, 0, n))
+            counts[job.id] = [0, 0, n] # wins, games played, games
+            job.Update(status = "running", progress = (0, n))
+        
+        async def Play(chunk):
+            winners, counts, timings = await loop.run_in_executor(self.pool.executor, PlayChunk, [game for (job, game) in chunk])
+            return chunk, winners
+        
+        chunks = [games[i:i + self.chunk_size] for i in range(0, len(games), self.chunk_size)]
+        for future in asyncio.as_completed([Play(chunk) for chunk in chunks]):
+            try:
+                chunk, winners = await future
+            except Exception as error:
+                for (job, work) in batch:
+                    if not job.finished:
+                        job.Update(status = "failed", error = repr(error))
+                return
+            
+            for ((job, game), winner) in zip(chunk, winners):
+                count = counts[job.id]
+                count[0] += winner == "player1"
+                count[1] += 1
+            for job in {job for (job, game) in chunk}:
+                wins, played, n = counts[job.id]
+                job.Update(progress = (played, n))
+                if played == n:
+                    job.Update(status = "done", result = {"winrate": (wins / n) * 100, "wins": wins, "games": n,
+                                                          "interval": list(WilsonInterval(wins, n))})
+        
+        return
+    
+    # Runs a tournament or a generations run in a thread with the checked values of its request, its games are played on the workers.
+    async def RunLongJob(self, job, work):
+        loop = asyncio.get_running_loop()
+        
+        def Progress(done, total):
+            loop.call_soon_threadsafe(lambda: job.Update(progress = (done, total)))
+        
+        def Run():
+            if job.kind == "tournament":
+                from tournament import Tournament
+                
+                result = Tournament(work["decks"], None, work["games"], work["format"], work["rounds"], work["seed"], self.pool,
+                                    progress = Progress)
+                return result.to_dict()
+            
+            top_deck = battle_simulator.Generations(work["generations"], battle_simulator.GetCatalog().cards, work["seed"], self.pool,
+                                                    tournament_format = work["tournament_format"], paired = work["paired"],
+                                                    progress = Progress, selection = work["selection"],
+                                                    population = work["population"], elites = work["elites"])
+            return {"deck": top_deck.deck_ids, "energy_zone": top_deck.energy_names}
+        
+        job.Update(status = "running")
+        try:
+            result = await loop.run_in_executor(self.threads, Run)
+        except Exception as error:
+            job.Update(status = "failed", error = repr(error))
+        else:
+            job.Update(status = "done", result = result)
+        
+        return
+    
+    # Answers one HTTP request, connections are closed after every response.
+    async def Handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) < 2:
+                return
+            method, path = request_line[0], request_line[1].split("?")[0].rstrip("/")
+            
+            try:
+                length = headers.get("content-length", "0")
+                if not length.isdigit() or int(length) > MAX_BODY:
+                    raise RequestError(400, "Content-Length must be a number of bytes up to {}".format(MAX_BODY))
+                body = await reader.readexactly(int(length))
+                await self.Route(method, path, body, writer)
+            except RequestError as error:
+                self.Respond(writer, error.status, {"error": str(error)})
+            except (ConnectionError, asyncio.IncompleteReadError):
+                raise
+            except Exception as error: # a bug, the client still gets an answer
+                self.Respond(writer, 500, {"error": repr(error)})
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    
+    async def Route(self, method, path, body, writer):
+        parts = path.strip("/").split("/")
+        if method == "GET" and path == "/health":
+            self.Respond(writer, 200, {"status": "ok", "workers": self.pool.workers, "jobs": len(self.jobs)})
+        elif method == "POST" and path == "/jobs":
+            try:
+                request = json.loads(body or b"null")
+            except ValueError:
+                raise RequestError(400, "the body must be json")
+            self.Respond(writer, 202, self.Submit(request).to_dict())
+        elif method == "GET" and path == "/jobs":
+            self.Respond(writer, 200, [job.to_dict() for job in self.jobs.values()])
+        elif method == "GET" and len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.jobs.get(parts[1])
+            if job is None:
+                raise RequestError(404, "no job {}".format(parts[1]))
+            if len(parts) == 2:
+                self.Respond(writer, 200, job.to_dict())
+            elif parts[2] == "events":
+                await self.Stream(job, writer)
+            else:
+                raise RequestError(404, "not found")
+        else:
+            raise RequestError(404, "not found")
+        
+        return
+    
+    def Respond(self, writer, status, content):
+        body = json.dumps(content).encode()
+        reason = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}.get(status, "Error")
+        writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
+            status, reason, len(body)).encode() + body)
+        
+        return
+    
+    # Writes the job as a json line every time it changes until it is finished, the end of the response is the end of the connection.
+    async def Stream(self, job, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n")
+        while True:
+            changed = job.changed
+            writer.write(json.dumps(job.to_dict()).encode() + b"\n")
+            await writer.drain()
+            if job.finished:
+                return
+            await changed.wait()
+    
+    def Close(self):
+        self.threads.shutdown()
+        self.pool.Close()
+        
+        return
+
+# Serves until interrupted, on host:port or on a Unix socket when unix_path is given.
+async def Serve(server, host = "127.0.0.1", port = 8765, unix_path = None):
+    if unix_path is not None:
+        listener = await asyncio.start_unix_server(server.Handle, unix_path)
+    else:
+        listener = await asyncio.start_server(server.Handle, host, port)
+    
+    async with listener:
+        await listener.serve_forever()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Runs the simulator as a local job service.")
+    parser.add_argument("--card-pool", default = battle_simulator.DEFAULT_CARD_POOL_PATH, help = "card pool json to load")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--unix", default = None, help = "Unix socket path to listen on instead of a port")
+    parser.add_argument("--workers", type = int, default = 0, help = "processes to play games in, 0 for one per core")
+    parser.add_argument("--batch-delay", type = float, default = 0.05, help = "seconds evaluations wait to be batched together")
+    parser.add_argument("--chunk-size", type = int, default = 50, help = "games sent to a worker at a time")
+    args = parser.parse_args(argv)
+    
+    battle_simulator.SetCatalog(battle_simulator.LoadCardCatalog(args.card_pool))
+    server = JobServer(args.workers or None, args.batch_delay, args.chunk_size)
+    try:
+        asyncio.run(Serve(server, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.Close()
+    
+    return
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# This program keeps the results of past evaluations so the same matchups don't have to be played again.
+# Results are kept per pair of deck signatures, in memory and optionally in an SQLite file that lasts between runs.
+
+import collections
+import sqlite3
+
+# The opponent signature used for games against random decks.
+RANDOM_OPPONENT = "*"
+
+# A canonical signature of a deck: its sorted card ids and sorted energy zone, so the order of the cards doesn't matter.
+def DeckSignature(deck_ids, energy_zone):
+    return ",".join(sorted(deck_ids)) + "|" + ",".join(sorted(energy_zone))
+
+# Win, draw and game counts of decks against opponents, with the least recently used matchups dropped from memory
+# once there are more than capacity of them. When a path is given the counts are also kept in an SQLite file,
+# where new games are added on top of what is already there so several runs can share the same file.
+class MatchupCache:
+    def __init__(self, capacity = 100000, path = None):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict() # key -> [wins, draws, games, unsaved wins, unsaved draws, unsaved games]
+        self.unsaved = 0
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS matchups (deck TEXT, opponent TEXT, wins INTEGER, draws INTEGER, "
+                            "games INTEGER, PRIMARY KEY (deck, opponent))")
+            self.db.commit()
+    
+    # Matchups between two decks are stored once, under the decks in sorted order, and flipped when read the other way around.
+    def Key(self, deck, opponent):
+        if opponent != RANDOM_OPPONENT and opponent < deck:
+            return (opponent, deck), True
+        return (deck, opponent), False
+    
+    # The entry for a key, loading it from the file if it isn't in memory.
+    def Entry(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return entry
+        
+        entry = [0, 0, 0, 0, 0, 0]
+        if self.db is not None:
+            row = self.db.execute("SELECT wins, draws, games FROM matchups WHERE deck = ? AND opponent = ?", key).fetchone()
+            if row is not None:
+                entry[:3] = row
+        self.entries[key] = entry
+        
+        while len(self.entries) > self.capacity:
+            old_key, old_entry = self.entries.popitem(last = False)
+            if old_entry[5]:
+                self.Save([(old_key, old_entry)])
+        
+        return entry
+    
+    # Returns (wins, draws, games) of deck against opponent.
+    def Get(self, deck, opponent = RANDOM_OPPONENT):
+        key, flipped = self.Key(deck, opponent)
+        wins, draws, games = self.Entry(key)[:3]
+        if flipped:
+            wins = games - wins - draws
+        
+        return wins, draws, games
+    
+    # Adds the results of new games of deck against opponent to the counts.
+    def Add(self, deck, opponent, wins, draws, games):
+        if games == 0:
+            return
+        
+        key, flipped = self.Key(deck, opponent)
+        if flipped:
+            wins = games - wins - draws
+        entry = self.Entry(key)
+        for (i, amount) in enumerate((wins, draws, games)):
+            entry[i] += amount
+            entry[i + 3] += amount
+        
+        self.unsaved += 1
+        if self.db is not None and self.unsaved >= 1000:
+            self.Flush()
+        
+        return
+    
+    # Adds the unsaved games of the given entries to the file.
+    def Save(self, items):
+        if self.db is None:
+            return
+        
+        self.db.executemany("INSERT INTO matchups VALUES (?, ?, ?, ?, ?) ON CONFLICT (deck, opponent) DO UPDATE SET "
+                            "wins = wins + excluded.wins, draws = draws + excluded.draws, games = games + excluded.games",
+                            [key + tuple(entry[3:]) for (key, entry) in items])
+        self.db.commit()
+        for (key, entry) in items:
+            entry[3:] = [0, 0, 0]
+        
+        return
+    
+    # Writes every unsaved result to the file.
+    def Flush(self):
+        self.Save([(key, entry) for (key, entry) in self.entries.items() if entry[5]])
+        self.unsaved = 0
+        
+        return
+    
+    def Close(self):
+        if self.db is not None:
+            self.Flush()
+            self.db.close()
+            self.db = None
+        
+        return
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.Close()
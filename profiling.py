@@ -0,0 +1,114 @@
+# This program shows where the simulator spends its time.
+# It can time the phases of every turn with battle_simulator's PhaseTimer, and profile a whole run with cProfile,
+# saving the profile as a .prof file and as folded stacks that flamegraph.pl or speedscope can draw as a flame graph.
+
+import argparse
+import cProfile
+import pstats
+import random
+
+import battle_simulator
+
+# Runs function(*args, **kwargs) under cProfile and returns its result and the profile's pstats.Stats.
+# The profile is saved to prof_path and folded_path when they are given.
+def ProfileRun(function, *args, prof_path = None, folded_path = None, **kwargs):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        result = function(*args, **kwargs)
+    finally:
+        profiler.disable()
+    
+    stats = pstats.Stats(profiler)
+    if prof_path is not None:
+        stats.dump_stats(prof_path)
+    if folded_path is not None:
+        WriteFoldedStacks(stats, folded_path)
+    
+    return result, stats
+
+# The name of a function in a folded stack.
+def FrameName(function):
+    filename, line, name = function
+    if filename == "~":
+        return name
+    return "{}:{}:{}".format(filename.replace("\\", "/").rpartition("/")[2], line, name)
+
+# Turns a profile into folded stacks ("caller;callee;... microseconds" lines).
+# cProfile only keeps which function called which, not whole stacks, so the stacks are rebuilt from the roots down
+# and each function's time is split between its callers in the same proportion as the time they spent calling it.
+# Recursive calls are cut off where a function is already on the stack.
+def FoldedStacks(stats, max_depth = 64):
+    callees = {}
+    for (function, (cc, nc, tt, ct, callers)) in stats.stats.items():
+        for (caller, edge) in callers.items():
+            callees.setdefault(caller, []).append((function, edge[3]))
+    roots = [function for (function, entry) in stats.stats.items() if not entry[4]]
+    
+    folded = {}
+    
+    # Adds a function's own time to its stack and then walks into what it called, fraction is the share of its time on this stack.
+    def Walk(function, stack, fraction):
+        cc, nc, tt, ct, callers = stats.stats[function]
+        stack = stack + (FrameName(function),)
+        own = tt * fraction * 1e6
+        if own >= 1:
+            key = ";".join(stack)
+            folded[key] = folded.get(key, 0) + own
+        
+        if len(stack) >= max_depth:
+            return
+        for (callee, edge_time) in callees.get(function, ()):
+            callee_time = stats.stats[callee][3]
+            if callee_time <= 0 or FrameName(callee) in stack:
+                continue
+            Walk(callee, stack, fraction * edge_time / callee_time)
+        
+        return
+    
+    for root in roots:
+        Walk(root, (), 1.0)
+    
+    return folded
+
+# Saves a profile as folded stacks.
+def WriteFoldedStacks(stats, path):
+    with open(path, "w") as f:
+        for (stack, microseconds) in sorted(FoldedStacks(stats).items()):
+            f.write("{} {}\n".format(stack, int(round(microseconds))))
+    
+    return
+
+# Evaluates random decks against random opponents, the run that is timed or profiled from the command line.
+def EvaluationRun(decks = 20, games = 10, seed = 0, pool = None):
+    population = battle_simulator.GenerateRandomDecks(None, decks, random.Random(seed))
+    return battle_simulator.EvaluateDecks(population, None, games, None, seed, pool)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Times the turn phases of an evaluation run and profiles it.")
+    parser.add_argument("--decks", type = int, default = 50, help = "random decks to evaluate")
+    parser.add_argument("--games", type = int, default = 20, help = "games per deck")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--workers", type = int, default = 1, help = "processes to play games in, 0 for one per core")
+    parser.add_argument("--prof", default = None, help = "file to save the cProfile profile to")
+    parser.add_argument("--folded", default = None, help = "file to save folded stacks for a flame graph to")
+    parser.add_argument("--top", type = int, default = 15, help = "functions to print from the profile")
+    args = parser.parse_args(argv)
+    
+    timer = battle_simulator.EnablePhaseTiming()
+    with battle_simulator.OptionalPool(args.workers or None) as pool:
+        if args.prof is not None or args.folded is not None:
+            # With workers the profile only covers this process, the phase timings cover every worker.
+            result, stats = ProfileRun(EvaluationRun, args.decks, args.games, args.seed, pool,
+                                       prof_path = args.prof, folded_path = args.folded)
+            stats.sort_stats("cumulative").print_stats(args.top)
+        else:
+            EvaluationRun(args.decks, args.games, args.seed, pool)
+    battle_simulator.DisablePhaseTiming()
+    
+    print(timer.Report())
+    
+    return
+
+if __name__ == "__main__":
+    main()
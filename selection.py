@@ -0,0 +1,171 @@
+# This program breeds the next generation of a Generations() run with elitism, tournament selection and crossover,
+# instead of the bracket where each pair of decks keeps its better half. The population stays the same size every generation
+# and never holds the same deck twice (decks are compared by signature), so no games are spent on a deck that is already there.
+# Decks are ranked on two objectives, win rate and how soon they can attack (see DeckAnalytics), by Pareto fronts.
+
+import collections
+
+import battle_simulator
+from battle_simulator import DeriveSeed, EvaluateDecks, FillDeck, GenerateRandomDecks, GetCatalog, MutatedDeck, Player, WilsonInterval
+
+BRACKET = "bracket"
+ELITIST = "elitist"
+SELECTIONS = (BRACKET, ELITIST)
+GAMES = 10 # games every new deck plays against random decks, and every elite plays again, each generation
+
+# The Pareto front of every score, 0 for the scores no other score beats on every objective, 1 for the scores only beaten
+# by front 0 and so on. Every objective is maximised.
+def ParetoRanks(scores):
+    def Dominates(a, b):
+        return all(x >= y for (x, y) in zip(a, b)) and a != b
+    
+    ranks = [None] * len(scores)
+    remaining = set(range(len(scores)))
+    rank = 0
+    while remaining:
+        front = [i for i in remaining if not any(Dominates(scores[j], scores[i]) for j in remaining)]
+        for i in front:
+            ranks[i] = rank
+        remaining.difference_update(front)
+        rank += 1
+    
+    return ranks
+
+# The objectives of a deck: its win rate, and minus the expected turn its first attack can be paid for.
+def Objectives(deck, winrate):
+    turn = GetCatalog().analytics.Analyze(deck.deck_ids, deck.energy_names)["first_attack_turn"]
+    
+    return (winrate, -turn if turn is not None else float("-inf"))
+
+# The basic Pokemon a card evolves from, following its earlier stages.
+def LineRoot(card):
+    evolves_from_index = GetCatalog().evolves_from_index
+    seen = set() # the card pool has cards that evolve from themselves
+    while evolves_from_index[card] != -1 and card not in seen:
+        seen.add(card)
+        card = evolves_from_index[card]
+    
+    return card
+
+# A child of two decks: the cards of both parents are split into evolution lines, and whole lines are taken at random
+# until the deck is full or no more copies are allowed. The energy zone comes from one of the parents.
+# The child is finished with FillDeck(), so it has at most 2 copies of a card and at least one basic Pokemon.
+def Crossover(parent1, parent2, candidates, rng):
+    energy_zone = list(rng.choice((parent1, parent2)).energy_zone)
+    lines = []
+    for parent in (parent1, parent2):
+        by_root = collections.defaultdict(list)
+        for card in parent.deck:
+            by_root[LineRoot(card)].append(card)
+        lines.extend(by_root.values())
+    rng.shuffle(lines)
+    
+    child = []
+    copies = collections.Counter()
+    for line in lines:
+        for card in line:
+            if len(child) < 20 and copies[card] < 2:
+                child.append(card)
+                copies[card] += 1
+    
+    # FillDeck() only adds a basic Pokemon when there is room for it.
+    if not any(GetCatalog().is_basic[card] for card in child):
+        child.pop(rng.randrange(len(child)))
+    
+    return Player(FillDeck(child, energy_zone, candidates, rng), energy_zone)
+
+# Replaces every deck that is already in the population (by signature) with a new random deck.
+def Deduplicate(decks, cardPool, rng):
+    seen = set()
+    unique = []
+    for deck in decks:
+        while deck.signature in seen:
+            if battle_simulator.metrics is not None:
+                battle_simulator.metrics.Count("selection.duplicates")
+            deck = GenerateRandomDecks(cardPool, 1, rng, prefilter = True)
+        seen.add(deck.signature)
+        unique.append(deck)
+    
+    return unique
+
+# Plays a generation's games and returns [wins, games] for every deck. The first len(records) decks are the elites
+# of the last generation with their records so far. Against random decks new decks play GAMES games, and every elite
+# plays GAMES more with fresh seeds that are added to its record, so a deck that got lucky once is found out as it keeps playing.
+# With a cache an elite is asked for GAMES more games than it has, so the cache only plays the new ones.
+# A tournament needs every deck as an opponent, so with a tournament format every deck plays and the records start again.
+def PlayGeneration(decks, records, cardPool, rng, pool, cache, settings):
+    seed = rng.getrandbits(64)
+    if settings["tournament_format"] is not None:
+        from tournament import Tournament
+        result = Tournament(decks, cardPool, settings["tournament_games"], settings["tournament_format"], None, seed, pool, cache)
+        return [[sum(result.wins[i]), sum(result.games[i])] for i in range(len(result))]
+    
+    elites = decks[:len(records)]
+    children = decks[len(records):]
+    winrates = EvaluateDecks(children, cardPool, GAMES, None, seed, pool, cache)
+    new_records = [[round(winrate * GAMES / 100), GAMES] for winrate in winrates]
+    if not elites:
+        return new_records
+    
+    elite_seed = DeriveSeed(seed, "elites")
+    if cache is None:
+        winrates = EvaluateDecks(elites, cardPool, GAMES, None, elite_seed, pool)
+        elite_records = [[wins + round(winrate * GAMES / 100), games + GAMES] for ((wins, games), winrate) in zip(records, winrates)]
+    else:
+        n = max(games for (wins, games) in records) + GAMES
+        winrates = EvaluateDecks(elites, cardPool, n, None, elite_seed, pool, cache)
+        elite_records = [[round(winrate * n / 100), n] for winrate in winrates]
+    
+    return elite_records + new_records
+
+# Breeds the next generation from a played one, records are the [wins, games] of every deck.
+# The settings["elites"] decks with the best Wilson lower bound on their win rate are kept as they are, so a deck needs
+# to keep winning over more games to stay, and the rest of the population is made of children:
+# a parent is chosen by tournament selection (the best of settings["tournament_size"] random decks by Pareto front, then win rate),
+# crossed with a second parent with chance settings["crossover_rate"], and settings["mutation_cards"] of its cards are swapped.
+# Children that could never attack or are already in the population are thrown away.
+# Returns the new population with the elites first (best first) and the elites' records.
+def SelectionGeneration(decks, records, cardPool, rng, settings):
+    size = settings["population"]
+    winrates = [(wins / games) * 100 if games else 0.0 for (wins, games) in records]
+    lower_bounds = [WilsonInterval(wins, games)[0] for (wins, games) in records]
+    order = sorted(range(len(decks)), key = lambda i: (-lower_bounds[i], -winrates[i]))
+    ranks = ParetoRanks([Objectives(deck, winrate) for (deck, winrate) in zip(decks, winrates)])
+    
+    def Select():
+        contestants = rng.sample(range(len(decks)), min(settings["tournament_size"], len(decks)))
+        return decks[min(contestants, key = lambda i: (ranks[i], -winrates[i]))]
+    
+    elites = order[:min(settings["elites"], size)]
+    population = [decks[i] for i in elites]
+    seen = {deck.signature for deck in population}
+    catalog = GetCatalog()
+    candidates = catalog.PoolIndices(cardPool)
+    
+    for attempt in range(size * 50):
+        if len(population) >= size:
+            break
+        child = Select()
+        if rng.random() < settings["crossover_rate"]:
+            child = Crossover(child, Select(), candidates, rng)
+        child = MutatedDeck(child, settings["mutation_cards"], candidates, rng)
+        
+        if catalog.Hopeless(child.deck, child.energy_zone):
+            if battle_simulator.metrics is not None:
+                battle_simulator.metrics.Count("selection.prefiltered")
+            continue
+        if child.signature in seen:
+            if battle_simulator.metrics is not None:
+                battle_simulator.metrics.Count("selection.duplicates")
+            continue
+        seen.add(child.signature)
+        population.append(child)
+    
+    # A population that has converged may not have enough new children, it is topped up with random decks.
+    while len(population) < size:
+        deck = GenerateRandomDecks(cardPool, 1, rng, prefilter = True)
+        if deck.signature not in seen:
+            seen.add(deck.signature)
+            population.append(deck)
+    
+    return population, [records[i] for i in elites]
@@ -0,0 +1,53 @@
+# Seeded regression tests: the same seed has to give the same results whether the games are played in this process
+# or on a pool of workers, and whether a Generations() run is stopped and resumed or played straight through.
+# Run with python -m pytest.
+
+import random
+
+import pytest
+
+from battle_simulator import EvaluateDecks, EvaluationPool, GenerateRandomDecks, Generations, GetCatalog, ResumeGenerations
+
+# A small card pool, so that random opponents drawn in the workers come from the same cards as in this process.
+def RestrictedPool():
+    return GetCatalog().cards[:60]
+
+def test_pooled_evaluation_matches_serial():
+    cardPool = RestrictedPool()
+    decks = GenerateRandomDecks(cardPool, 6, random.Random(1), prefilter = True)
+    serial = EvaluateDecks(decks, cardPool, 12, None, 7)
+    with EvaluationPool(2, chunksize = 5) as pool:
+        pooled = EvaluateDecks(decks, cardPool, 12, None, 7, pool)
+    
+    assert pooled == serial
+
+class Interrupted(Exception):
+    pass
+
+# Stops a run when it reaches the given generation.
+def StopAt(generation):
+    def Progress(i, generations):
+        if i == generation:
+            raise Interrupted()
+    
+    return Progress
+
+@pytest.mark.parametrize("options", [{"selection": "bracket"}, {"selection": "elitist", "population": 6, "elites": 2}])
+def test_resumed_run_matches_uninterrupted(tmp_path, options):
+    cardPool = RestrictedPool()
+    straight = Generations(3, cardPool, 5, checkpoint = str(tmp_path / "straight.json.gz"), **options)
+    
+    checkpoint = str(tmp_path / "stopped.json.gz")
+    with pytest.raises(Interrupted):
+        Generations(3, cardPool, 5, checkpoint = checkpoint, progress = StopAt(2), **options)
+    resumed = ResumeGenerations(checkpoint, cardPool)
+    
+    assert resumed.signature == straight.signature
+
+def test_pooled_generations_match_serial():
+    cardPool = RestrictedPool()
+    serial = Generations(3, cardPool, 2)
+    with EvaluationPool(2) as pool:
+        pooled = Generations(3, cardPool, 2, pool)
+    
+    assert pooled.signature == serial.signature
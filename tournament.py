@@ -0,0 +1,213 @@
+# This program plays a population of decks against each other, instead of each deck only against random decks,
+# and ranks them from the results with Elo and Bradley-Terry ratings.
+# Pairings are scheduled as a round robin (every deck plays every other deck) or as Swiss rounds (decks with similar scores meet).
+
+import math
+import random
+
+from battle_simulator import DeriveSeed, PlayGames
+
+ROUND_ROBIN = "round-robin"
+SWISS = "swiss"
+FORMATS = (ROUND_ROBIN, SWISS)
+
+# The results of a tournament, wins[i][j] is how many games deck i won against deck j.
+# Draws and games are kept the same way, draws[i][j] == draws[j][i] and games[i][j] == games[j][i].
+class TournamentResult:
+    def __init__(self, decks):
+        size = len(decks)
+        self.decks = decks
+        self.wins = [[0] * size for i in range(size)]
+        self.draws = [[0] * size for i in range(size)]
+        self.games = [[0] * size for i in range(size)]
+        self.match_points = [0.0] * size # 1 for winning a pairing, 0.5 for tying it
+        self.matches = [] # (i, j, score of i, games) of every pairing in the order they were played
+    
+    def __len__(self):
+        return len(self.decks)
+    
+    # Adds the games of a pairing between deck i and deck j.
+    def Record(self, i, j, wins, draws, games):
+        losses = games - wins - draws
+        self.wins[i][j] += wins
+        self.wins[j][i] += losses
+        self.draws[i][j] += draws
+        self.draws[j][i] += draws
+        self.games[i][j] += games
+        self.games[j][i] += games
+        
+        if wins > losses:
+            self.match_points[i] += 1
+        elif losses > wins:
+            self.match_points[j] += 1
+        else:
+            self.match_points[i] += 0.5
+            self.match_points[j] += 0.5
+        self.matches.append((i, j, wins + draws / 2, games))
+        
+        return
+    
+    # The win rate of deck i against deck j as a percentage, None if they haven't played.
+    def WinRate(self, i, j):
+        return (self.wins[i][j] / self.games[i][j]) * 100 if self.games[i][j] else None
+    
+    # The N x N matrix of win rates, the diagonal and pairs that haven't played are None.
+    def WinMatrix(self):
+        return [[self.WinRate(i, j) for j in range(len(self))] for i in range(len(self))]
+    
+    # The win rate of each deck over all of its games, draws count as not winning like DeckEvaluation().
+    def WinRates(self):
+        winrates = []
+        for i in range(len(self)):
+            games = sum(self.games[i])
+            winrates.append((sum(self.wins[i]) / games) * 100 if games else 0.0)
+        
+        return winrates
+    
+    # Dictionary that can be put into json files.
+    def to_dict(self):
+        elo = EloRatings(self)
+        strengths = BradleyTerry(self)
+        return {
+            "decks": [deck.to_dict() for deck in self.decks],
+            "win_matrix": self.WinMatrix(),
+            "wins": self.wins,
+            "draws": self.draws,
+            "games": self.games,
+            "elo": elo,
+            "bradley_terry": strengths,
+            "bradley_terry_elo": StrengthsToElo(strengths)
+            }
+
+# The pairings of a round robin, every deck against every other deck once.
+def RoundRobinPairings(size):
+    return [(i, j) for i in range(size) for j in range(i + 1, size)]
+
+# The pairings of a Swiss round: decks are ranked by match points and each one is paired with the next ranked deck
+# it hasn't met yet, or with the next ranked deck if it has met all of them. With an odd number of decks
+# the lowest ranked deck that hasn't had a bye sits the round out.
+def SwissPairings(result, byes):
+    order = sorted(range(len(result)), key = lambda i: (-result.match_points[i], i))
+    if len(order) % 2:
+        bye = next((i for i in reversed(order) if i not in byes), order[-1])
+        byes.add(bye)
+        order.remove(bye)
+    
+    pairings = []
+    while order:
+        i = order.pop(0)
+        position = next((p for (p, j) in enumerate(order) if result.games[i][j] == 0), 0)
+        j = order.pop(position)
+        pairings.append((min(i, j), max(i, j)))
+    
+    return pairings
+
+# Plays a round of pairings as one batch, so a pool can spread every pairing's games over its workers.
+# The decks swap who is player1 every game. With a MatchupCache a pairing meeting for the first time only plays the games
+# it is missing to reach games, and its results cover every game recorded for the matchup.
+def PlayRound(result, pairings, games, seed, round_number, cardPool = None, pool = None, cache = None):
+    decks = result.decks
+    jobs = []
+    plan = []
+    for (i, j) in pairings:
+        start = 0
+        if cache is not None and result.games[i][j] == 0:
+            start = min(cache.Get(decks[i].signature, decks[j].signature)[2], games)
+        plan.append((i, j, start))
+        
+        for k in range(start, games):
+            first, second = (decks[i], decks[j]) if k % 2 == 0 else (decks[j], decks[i])
+            jobs.append((first.deck, first.energy_zone, second.deck, second.energy_zone, DeriveSeed(seed, round_number, i, j, k)))
+    
+    winners = PlayGames(jobs, cardPool, pool)
+    
+    played = 0
+    for (i, j, start) in plan:
+        wins = draws = 0
+        for k in range(start, games):
+            winner = winners[played]
+            played += 1
+            if winner is None:
+                draws += 1
+            elif (winner == "player1") == (k % 2 == 0):
+                wins += 1
+        
+        if cache is None:
+            result.Record(i, j, wins, draws, games)
+        else:
+            cache.Add(decks[i].signature, decks[j].signature, wins, draws, games - start)
+            if start:
+                wins, draws, total = cache.Get(decks[i].signature, decks[j].signature)
+                result.Record(i, j, wins, draws, total)
+            else:
+                result.Record(i, j, wins, draws, games)
+    
+    return
+
+# Plays a tournament between decks (Player objects) and returns a TournamentResult.
+# Every pairing plays games games, a round robin plays every pairing once and Swiss plays rounds rounds
+# (enough to find a clear winner, log2 of the number of decks, if not given).
+# progress is called with the number of rounds played and the number of rounds after every round.
+def Tournament(decks, cardPool = None, games = 10, format = ROUND_ROBIN, rounds = None, seed = None, pool = None, cache = None,
+               progress = None):
+    if format not in FORMATS:
+        raise ValueError("Unknown tournament format {!r}, expected one of {}".format(format, FORMATS))
+    if seed is None:
+        seed = random.getrandbits(64)
+    
+    result = TournamentResult(list(decks))
+    if len(result) < 2:
+        return result
+    
+    if format == ROUND_ROBIN:
+        PlayRound(result, RoundRobinPairings(len(result)), games, seed, 0, cardPool, pool, cache)
+        if progress is not None:
+            progress(1, 1)
+    else:
+        byes = set()
+        rounds = rounds or math.ceil(math.log2(len(result)))
+        for round_number in range(rounds):
+            PlayRound(result, SwissPairings(result, byes), games, seed, round_number, cardPool, pool, cache)
+            if progress is not None:
+                progress(round_number + 1, rounds)
+    
+    return result
+
+# Elo ratings from the pairings in the order they were played, each pairing counts as games rated games at once.
+def EloRatings(result, k = 16, initial = 1500):
+    ratings = [float(initial)] * len(result)
+    for (i, j, score, games) in result.matches:
+        expected = 1 / (1 + 10 ** ((ratings[j] - ratings[i]) / 400))
+        change = k * (score - games * expected)
+        ratings[i] += change
+        ratings[j] -= change
+    
+    return ratings
+
+# Bradley-Terry strengths fitted with the minorization-maximization algorithm, a draw counts as half a win for each deck.
+# Every pair that has played gets prior extra games split evenly, so a deck that never won still gets a strength above 0.
+# The strengths are scaled so their geometric mean is 1, deck i beats deck j with probability s[i] / (s[i] + s[j]).
+def BradleyTerry(result, prior = 1.0, iterations = 1000, tolerance = 1e-9):
+    size = len(result)
+    opponents = [[(j, result.games[i][j] + prior) for j in range(size) if j != i and result.games[i][j]] for i in range(size)]
+    scores = [sum(result.wins[i][j] + (result.draws[i][j] + prior) / 2 for (j, games) in opponents[i]) for i in range(size)]
+    
+    strengths = [1.0] * size
+    for iteration in range(iterations):
+        new_strengths = []
+        for i in range(size):
+            denominator = sum(games / (strengths[i] + strengths[j]) for (j, games) in opponents[i])
+            new_strengths.append(scores[i] / denominator if denominator else strengths[i])
+        
+        mean = math.exp(sum(math.log(strength) for strength in new_strengths) / size) if size else 1.0
+        new_strengths = [strength / mean for strength in new_strengths]
+        change = max((abs(new - old) for (new, old) in zip(new_strengths, strengths)), default = 0)
+        strengths = new_strengths
+        if change < tolerance:
+            break
+    
+    return strengths
+
+# Bradley-Terry strengths on the Elo scale, 400 points is 10 to 1 odds.
+def StrengthsToElo(strengths, initial = 1500):
+    return [initial + 400 * math.log10(strength) for strength in strengths]